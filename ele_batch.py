@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import ele_loader
+import ele_program
+import ele_project
+import ele_profile
+
+
+
+# Non-interactive entry point: every manifest given on the command line is turned into a track XML file.
+#
+#   python ele_batch.py variant1.csv variant2.json variant3.dat -o tracks/
+#
+# The blueprint library is parsed once by this process and handed to each worker when it starts,
+# then the projects are spread over the pool. A manifest may be a project (.dat, .elp) or a list of
+# placements in CSV or JSON, see ele_project.
+
+# blueprint library of this worker process, set by _init_worker
+_blueprints = None
+
+def _init_worker(blueprints):
+    global _blueprints
+    _blueprints = blueprints
+
+# generate the track of a single manifest, this runs inside the worker processes
+# @param deduplicate = remove duplicate items from the track, see Program.iter_items
+# @param track = track file saved by Liftoff whose items are replaced, see Program.merge_xml
+# @return (instances, items, removed duplicates, seconds)
+def run_project(manifest, output, instance_id_counter=0, blueprints=None, deduplicate=False, track=None):
+    start = time.perf_counter()
+    program = ele_program.Program()
+    program.blueprints = _blueprints if blueprints is None else blueprints
+    program.instance_id_counter = instance_id_counter
+    program.deduplicate = deduplicate
+
+    with ele_profile.operation("run_project"):
+        with ele_profile.phase("read"):
+            names, placements = ele_project.read_project(manifest)
+        program.add_instances(names, placements)
+        if track is not None:
+            removed = program.merge_xml(track, output)
+        else:
+            with open(output, "w") as file:
+                removed = program.generate_xml(file)
+
+    n_items = program.instance_id_counter - instance_id_counter - removed
+    return (len(program.instances), n_items, removed, time.perf_counter() - start)
+
+# where the track of a manifest is written
+# @param output = folder, or file name when there is a single manifest and it ends with .xml
+def output_path(manifest, output, single):
+    if single and output.lower().endswith(".xml"):
+        return output
+    return os.path.join(output, os.path.splitext(os.path.basename(manifest))[0] + ".xml")
+
+# @return (manifest, instances, items, removed duplicates, seconds, error) for each manifest, in the given order
+# @raise ValueError if two manifests would be written to the same file, before anything is generated
+def run_batch(manifests, output, jobs=None, blueprints_directory=ele_loader.BLUEPRINTS_DIRECTORY, instance_id_counter=0,
+              deduplicate=False, track=None):
+    outputs = [output_path(manifest, output, len(manifests) == 1) for manifest in manifests]
+    # manifests with the same name in different folders, or with different extensions, would overwrite each other
+    writers = dict()
+    for manifest, path in zip(manifests, outputs):
+        key = os.path.normcase(os.path.abspath(path))
+        if key in writers:
+            raise ValueError("{} and {} would both be written to {}".format(writers[key], manifest, path))
+        writers[key] = manifest
+    blueprints, _ = ele_loader.load_library(blueprints_directory)
+    for path in outputs:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    jobs = min(jobs or os.cpu_count(), len(manifests))
+    results = list()
+    if jobs <= 1:
+        _init_worker(blueprints)
+        futures = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(blueprints,))
+        futures = [executor.submit(run_project, manifest, path, instance_id_counter, None, deduplicate, track) for manifest, path in zip(manifests, outputs)]
+    try:
+        for i, (manifest, path) in enumerate(zip(manifests, outputs)):
+            try:
+                if futures is None:
+                    instances, items, removed, seconds = run_project(manifest, path, instance_id_counter, None, deduplicate, track)
+                else:
+                    instances, items, removed, seconds = futures[i].result()
+                results.append((manifest, instances, items, removed, seconds, None))
+            except KeyError as e:
+                results.append((manifest, 0, 0, 0, 0, "blueprint {} does not exist".format(e)))
+            except (OSError, ValueError) as e:
+                results.append((manifest, 0, 0, 0, 0, str(e)))
+    finally:
+        if futures is not None:
+            executor.shutdown()
+    return results
+
+def format_results(results, elapsed):
+    lines = list()
+    for manifest, instances, items, removed, seconds, error in results:
+        if error is None:
+            rate = items / seconds if seconds > 0 else 0
+            line = "{}{}{}{:.2f} s  {:.0f} items/s".format(os.path.basename(manifest).ljust(30, ' '),
+                                                          str(instances).ljust(10, ' '),
+                                                          str(items).ljust(10, ' '),
+                                                          seconds, rate)
+            if removed:
+                line += "  ({} duplicates removed)".format(removed)
+            lines.append(line)
+        else:
+            lines.append("{}FAILED: {}".format(os.path.basename(manifest).ljust(30, ' '), error))
+    total_items = sum(result[2] for result in results)
+    lines.append("{} projects, {} items in {:.2f} s ({:.0f} items/s)".format(len(results), total_items, elapsed,
+                                                                           total_items / elapsed if elapsed > 0 else 0))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the tracks of many projects without user interaction")
+    parser.add_argument("manifests", nargs="+", help="projects or placement lists (.dat, .elp, .csv, .json)")
+    parser.add_argument("-o", "--output", required=True, help="output folder, or .xml file for a single manifest")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: one per core)")
+    parser.add_argument("-b", "--blueprints", default=ele_loader.BLUEPRINTS_DIRECTORY, help="blueprints folder")
+    parser.add_argument("-c", "--instance-counter", type=int, default=0, help="last instance ID already used in the track")
+    parser.add_argument("-d", "--deduplicate", action="store_true", help="write items placed twice at the same position only once")
+    parser.add_argument("-t", "--track", default=None, help="write each project into a copy of this Liftoff track instead of a bare blueprints tag")
+    parser.add_argument("--profile", default=None, help="report the time of each phase, for example log,json=timings.jsonl (see ele_profile)")
+    args = parser.parse_args(argv)
+    if args.profile is not None:
+        try:
+            ele_profile.configure(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+
+    start = time.perf_counter()
+    try:
+        results = run_batch(args.manifests, args.output, args.jobs, args.blueprints, args.instance_counter, args.deduplicate, args.track)
+    except ValueError as e:
+        parser.error(str(e))
+    print(format_results(results, time.perf_counter() - start))
+    return 1 if any(result[5] is not None for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,476 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from math import radians
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pyquaternion import Quaternion
+
+import ele_utils
+import ele_rotation
+import ele_loader
+import ele_program
+import ele_profile
+import ele_spatial
+
+
+
+# build a blueprint with random items, without reading the blueprints folder
+# @param name = name of the blueprint
+# @param n_items = number of items inside the blueprint
+# @param seed = seed of the random generator, so that runs are reproducible
+# @return the synthetic blueprint
+def synthetic_blueprint(name, n_items, seed=0):
+    rng = random.Random(seed)
+    blueprint = ele_utils.Blueprint(name)
+    for instance_id in range(1, n_items+1):
+        item = ele_utils.Item("DrawingBoardCube1m{:02d}".format(rng.randrange(10)), instance_id,
+                              rng.uniform(-10, 10), rng.uniform(0, 10), rng.uniform(-10, 10),
+                              rng.choice((0.0, 90.0, 180.0, 270.0)), rng.uniform(0, 360), rng.choice((0.0, 90.0)))
+        blueprint.add(item)
+    return blueprint
+
+# write a folder of blueprint files in the format read by ele_loader
+def synthetic_library(directory, n_files, items_per_file, seed=0):
+    for i in range(n_files):
+        blueprint = synthetic_blueprint("synthetic{}".format(i), items_per_file, seed + i)
+        with open(os.path.join(directory, blueprint.name + ".xml"), "w") as file:
+            file.write('<blueprints xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">')
+            file.writelines(blueprint.iter_xml())
+            file.write('\n</blueprints>')
+
+# write a project file placing the given blueprint many times
+# @return the path of the project file
+def synthetic_project(directory, name, n_instances, seed=0):
+    rng = random.Random(seed)
+    path = os.path.join(directory, "project.dat")
+    with open(path, "w") as file:
+        lines = ("{}:{}:{}:{}:{}:{}:{}".format(name,
+                                               round(rng.uniform(-500, 500), 3),
+                                               round(rng.uniform(0, 50), 3),
+                                               round(rng.uniform(-500, 500), 3),
+                                               rng.choice((0, 90, 180, 270)),
+                                               round(rng.uniform(0, 360), 3),
+                                               0) for _ in range(n_instances))
+        file.write('\n'.join(lines))
+    return path
+
+
+
+# the per-item layout used before ItemTable: a plain object with eight attributes,
+# the three quaternions of the local axis and the quaternion of the rotation
+class _LegacyItem:
+    def __init__(self, item_id, instance_id, pos_x, pos_y, pos_z, rot_x, rot_y, rot_z):
+        self.item_id = item_id
+        self.instance_id = instance_id
+        self.pos_x = pos_x
+        self.pos_y = pos_y
+        self.pos_z = pos_z
+        self.rot_x = rot_x
+        self.rot_y = rot_y
+        self.rot_z = rot_z
+        self.orientation = tuple(Quaternion(axis.elements) for axis in ele_utils.AXIS)
+        self.quat = Quaternion(axis=[0, 1, 0], angle=radians(rot_y))
+
+# peak and retained memory allocated by a function
+# @return (result, retained bytes, peak bytes)
+def _measure(function, *args):
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current, peak
+
+def _legacy_items(n_items):
+    return [_LegacyItem("DrawingBoardCube1m00", i, 0.5*i, 1.5, -0.5*i, 0.0, 90.5, 0.0) for i in range(n_items)]
+
+
+
+# memory used by the instances of a project with about n_items items
+def bench_memory(n_items=100000, items_per_blueprint=100):
+    n_instances = max(n_items // items_per_blueprint, 1)
+    n_items = n_instances*items_per_blueprint
+
+    program = ele_program.Program()
+    program.blueprints["synthetic"] = synthetic_blueprint("synthetic", items_per_blueprint)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = synthetic_project(directory, "synthetic", n_instances)
+        start = time.perf_counter()
+        _, current, peak = _measure(lambda: list(program.load_project(path)))
+        elapsed = time.perf_counter() - start
+
+    # the legacy layout is measured on a sample and scaled, building it in full takes too long
+    sample = min(n_items, 10000)
+    _, legacy_current, _ = _measure(_legacy_items, sample)
+    legacy_per_item = legacy_current / sample
+
+    return { "items": n_items,
+             "instances": n_instances,
+             "load_seconds": round(elapsed, 3),
+             "retained_bytes": current,
+             "peak_bytes": peak,
+             "bytes_per_item": round(current / n_items, 1),
+             "legacy_bytes_per_item": round(legacy_per_item, 1),
+             "reduction": round(legacy_per_item / (current / n_items), 1) }
+
+
+
+# random (pitch, yaw, roll) triples, a part of them close to or exactly in gimbal lock
+def _angle_corpus(n_angles, seed=0):
+    rng = random.Random(seed)
+    pitches = (90.0, -90.0, 270.0, -270.0, 89.9999, -89.9999, 90.0001, -90.0001, 89.99, -89.99)
+    corpus = list()
+    for i in range(n_angles):
+        pitch = rng.choice(pitches) if i % 4 == 0 else rng.uniform(-360, 360)
+        corpus.append((pitch, rng.uniform(-360, 360), rng.uniform(-360, 360)))
+    return corpus
+
+# distance between two unit quaternions, which represent the same rotation when opposite
+def _quat_distance(quat_a, quat_b):
+    return min(max(abs(a - b) for a, b in zip(quat_a, quat_b)),
+               max(abs(a + b) for a, b in zip(quat_a, quat_b)))
+
+# the per-item rotation as done before ele_rotation: local axis tracking and pyquaternion products
+def _legacy_rotate(item_rotation, placement):
+    orientation = ele_utils.l_rotate(ele_utils.AXIS, *item_rotation)
+    quat = ele_utils.l_get_quat(ele_utils.AXIS, *item_rotation)
+    orientation = ele_utils.g_rotate(orientation, *placement)
+    return ele_utils.g_get_quat(*placement)*quat
+
+def _closed_form_rotate(item_rotation, placement):
+    quat = ele_rotation.local_euler_to_quat(*item_rotation)
+    return ele_rotation.quat_product(ele_rotation.global_euler_to_quat(*placement), quat)
+
+# check the closed-form conversions against the functions based on local axis and compare their speed
+# the Euler angles are validated by converting them back, since in gimbal lock yaw and roll are not unique
+def bench_rotation(n_items=20000, tolerance=1e-5):
+    items = _angle_corpus(n_items, seed=1)
+    placements = _angle_corpus(n_items, seed=2)
+
+    quat_error = 0
+    euler_error = 0
+    for item_rotation, placement in zip(items, placements):
+        expected = _legacy_rotate(item_rotation, placement).elements
+        quat = _closed_form_rotate(item_rotation, placement)
+        quat_error = max(quat_error, _quat_distance(expected, quat))
+        euler = ele_rotation.quat_to_euler(quat)
+        euler_error = max(euler_error, _quat_distance(expected, ele_rotation.local_euler_to_quat(*euler)))
+    if quat_error > tolerance or euler_error > tolerance:
+        raise AssertionError("closed-form rotation differs from the reference: {} {}".format(quat_error, euler_error))
+
+    # a smaller sample is enough for timing the slow path
+    sample = min(n_items, 5000)
+    start = time.perf_counter()
+    for item_rotation, placement in zip(items[:sample], placements[:sample]):
+        _legacy_rotate(item_rotation, placement)
+    legacy_seconds = (time.perf_counter() - start) / sample
+
+    start = time.perf_counter()
+    for item_rotation, placement in zip(items, placements):
+        ele_rotation.quat_to_euler(_closed_form_rotate(item_rotation, placement))
+    closed_form_seconds = (time.perf_counter() - start) / n_items
+
+    return { "items": n_items,
+             "max_quat_error": quat_error,
+             "max_euler_error": euler_error,
+             "legacy_us_per_item": round(legacy_seconds*1e6, 2),
+             "closed_form_us_per_item": round(closed_form_seconds*1e6, 2),
+             "speedup": round(legacy_seconds / closed_form_seconds, 1) }
+
+
+
+# a program holding a placed project of about n_items items, without reading any file
+def synthetic_program(n_items, items_per_blueprint=100, seed=0):
+    rng = random.Random(seed)
+    program = ele_program.Program()
+    program.blueprints["synthetic"] = synthetic_blueprint("synthetic", items_per_blueprint, seed)
+    for _ in range(max(n_items // items_per_blueprint, 1)):
+        program.add_instance("synthetic", rng.uniform(-500, 500), rng.uniform(0, 50), rng.uniform(-500, 500),
+                             rng.choice((0, 90, 180, 270)), rng.uniform(0, 360), 0)
+    return program
+
+# the export as done before generate_xml was streamed: the whole document is concatenated and written at once
+def _legacy_generate_xml(program, file):
+    xml_output = '  <blueprints>'
+    for instance in program.instances:
+        instance_output = ""
+        for item in instance.items:
+            instance_output += str(item)
+        xml_output += instance_output
+    xml_output += '\n  </blueprints>'
+    xml_output += '\n  <lastTrackItemID>{}</lastTrackItemID>'.format(program.instance_id_counter)
+    file.write(xml_output)
+
+# run in a separate process, so that the peak memory of each export is measured from a clean state
+# @param mode = "legacy" concatenates the whole document, "streamed" formats every item without caching,
+#               "cached" exports once, adds an instance and measures the second export
+def _export_worker(n_items, mode):
+    program = synthetic_program(n_items)
+    program.cache_xml = float("inf") if mode == "cached" else 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "track.xml")
+        if mode == "cached":
+            with open(path, "w") as file:
+                program.generate_xml(file)
+            program.add_instance("synthetic", 0, 0, 0, 0, 0, 0)
+        rss_before = ele_profile.peak_rss()
+        start = time.perf_counter()
+        with open(path, "w") as file:
+            if mode == "legacy":
+                _legacy_generate_xml(program, file)
+            else:
+                program.generate_xml(file)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+    rss_after = ele_profile.peak_rss()
+    growth = None if rss_before is None else rss_after - rss_before
+    return elapsed, growth, size
+
+# compare the streamed export with the concatenation of the whole document,
+# and measure an export after a single change when the XML code of the instances is cached
+def bench_export(n_items=500000):
+    results = dict()
+    for mode in ("streamed", "legacy", "cached"):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            elapsed, growth, size = executor.submit(_export_worker, n_items, mode).result()
+        results[mode + "_seconds"] = round(elapsed, 3)
+        results[mode + "_peak_rss_growth"] = growth
+        results[mode + "_file_bytes"] = size
+    results["items"] = n_items
+    return results
+
+
+
+# loading a project in this process and with a pool of one process per core, which must give the same instances
+def bench_materialize(n_items=1000000, items_per_blueprint=100):
+    n_instances = max(n_items // items_per_blueprint, 1)
+    results = { "instances": n_instances, "workers": os.cpu_count() }
+    with tempfile.TemporaryDirectory() as directory:
+        path = synthetic_project(directory, "synthetic", n_instances)
+        programs = list()
+        for label, workers in (("serial", 1), ("parallel", os.cpu_count())):
+            program = ele_program.Program()
+            program.blueprints["synthetic"] = synthetic_blueprint("synthetic", items_per_blueprint)
+            start = time.perf_counter()
+            program.load_project(path, workers)
+            results[label + "_seconds"] = round(time.perf_counter() - start, 3)
+            programs.append(program)
+    serial, parallel = programs
+    results["identical"] = all(a.items.instance_ids.tolist() == b.items.instance_ids.tolist()
+                               and np.array_equal(a.items.positions, b.items.positions)
+                               and np.array_equal(a.items.quats, b.items.quats)
+                               for a, b in zip(serial.instances, parallel.instances))
+    return results
+
+
+
+# startup time with and without the compiled library
+def bench_startup(n_items=100000, items_per_file=50):
+    n_files = max(n_items // items_per_file, 1)
+    results = { "files": n_files, "items": n_files*items_per_file }
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic_library(directory, n_files, items_per_file)
+        for label, use_cache in (("no_cache", False), ("cold", True), ("warm", True)):
+            start = time.perf_counter()
+            ele_loader.load_library(directory, use_cache=use_cache)
+            results[label + "_seconds"] = round(time.perf_counter() - start, 3)
+    return results
+
+
+
+# building the spatial index, the queries over the whole track and the update after adding or removing an instance
+def bench_spatial(n_items=100000):
+    program = synthetic_program(n_items)
+    results = { "items": len(program.instances)*len(program.instances[0].items) }
+    start = time.perf_counter()
+    program.spatial_index()
+    results["build_seconds"] = round(time.perf_counter() - start, 3)
+    for label, query in (("overlaps", program.find_overlaps), ("duplicates", program.find_duplicates),
+                         ("near", lambda: program.items_near(0, 0, 0, 20))):
+        start = time.perf_counter()
+        found = query()
+        results[label + "_seconds"] = round(time.perf_counter() - start, 3)
+        results[label + "_found"] = len(found)
+    start = time.perf_counter()
+    program.add_instance("synthetic", 0, 0, 0, 0, 0, 0)
+    program.remove_instance(0)
+    results["add_remove_seconds"] = round(time.perf_counter() - start, 4)
+    return results
+
+# splitting a track made of a single straight chain of items, stored in random order, which is the slowest case
+# for joining the pieces: the number of rounds must stay within the logarithm of the items
+def bench_clusters(n_items=200000, seed=0):
+    positions = np.zeros((n_items, 3))
+    positions[:, 0] = np.arange(n_items)*0.9
+    positions = positions[np.random.default_rng(seed).permutation(n_items)]
+    results = { "items": n_items }
+    start = time.perf_counter()
+    first, second = ele_spatial.close_pairs(positions, 1.0)
+    results["pairs_seconds"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    labels, rounds = ele_spatial._components(n_items, first, second)
+    results["components_seconds"] = round(time.perf_counter() - start, 3)
+    results["rounds"] = rounds
+    results["bounded"] = rounds <= int(np.ceil(np.log2(max(n_items, 2)))) + 1
+    results["single_piece"] = bool((labels == 0).all())
+    return results
+
+
+
+# the hot paths timed by the suite, see bench_paths
+SUITE_SIZES = (10, 1000, 100000)
+SUITE_REPEAT = 3
+
+# a timing is a regression when it is slower than the baseline by more than this fraction
+REGRESSION_THRESHOLD = 0.25
+# and by more than this many seconds, so that the noise of very short timings is ignored
+REGRESSION_MIN_SECONDS = 0.01
+
+# smallest time taken by a function over some runs
+def _best(function, repeat):
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+# time of each hot path for a track of about n_items items
+# @param repeat = each path is run this many times and the fastest run is kept
+def bench_paths(n_items=100000, repeat=SUITE_REPEAT, items_per_blueprint=100):
+    items_per_blueprint = min(items_per_blueprint, n_items)
+    n_instances = max(n_items // items_per_blueprint, 1)
+    results = { "items": n_instances*items_per_blueprint, "instances": n_instances }
+    with tempfile.TemporaryDirectory() as directory:
+        library = os.path.join(directory, "blueprints")
+        os.mkdir(library)
+        synthetic_library(library, n_instances, items_per_blueprint)
+        results["parse_seconds"] = _best(lambda: ele_loader.load_library(library, workers=1, use_cache=False), repeat)
+        ele_loader.load_library(library, workers=1)
+        results["load_cached_seconds"] = _best(lambda: ele_loader.load_library(library, workers=1), repeat)
+
+        program = ele_program.Program()
+        program.blueprints["synthetic"] = synthetic_blueprint("synthetic", items_per_blueprint)
+        project = synthetic_project(directory, "synthetic", n_instances)
+        results["load_project_seconds"] = _best(lambda: program.load_project(project), repeat)
+
+        # instances added one by one, as done by the editor
+        n_added = min(n_instances, 1000)
+        names, placements = program.placements()
+        def add_instances():
+            for placement in placements[:n_added].tolist():
+                program.add_instance("synthetic", *placement)
+        results["add_instance_seconds"] = _best(add_instances, repeat) / n_added
+
+        instances = program.instances[:n_added]
+        def rotate():
+            for instance in instances:
+                instance.rotate(10, 20, 30)
+        results["rotate_seconds"] = _best(rotate, repeat) / n_added
+
+        program.load_project(project)
+        output = os.path.join(directory, "output")
+        def save_project():
+            with open(output, "w") as file:
+                program.save_project(file)
+        results["save_project_seconds"] = _best(save_project, repeat)
+
+        program.cache_xml = 0
+        def generate_xml():
+            with open(output, "w") as file:
+                program.generate_xml(file)
+        results["generate_xml_seconds"] = _best(generate_xml, repeat)
+    for key in results:
+        if key.endswith("_seconds"):
+            results[key] = round(results[key], 6)
+    return results
+
+# the hot paths for each size, with what is needed to tell whether two runs are comparable
+def run_suite(sizes=SUITE_SIZES, repeat=SUITE_REPEAT):
+    return { "python": platform.python_version(),
+             "numpy": np.__version__,
+             "machine": platform.machine(),
+             "cpus": os.cpu_count(),
+             "repeat": repeat,
+             "results": { str(size): bench_paths(size, repeat) for size in sizes } }
+
+# timings slower than the baseline, for the sizes and paths measured by both runs
+# @return list of (size, path, baseline seconds, current seconds)
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD, min_seconds=REGRESSION_MIN_SECONDS):
+    regressions = list()
+    for size, timings in current["results"].items():
+        old_timings = baseline["results"].get(size, dict())
+        for key, seconds in timings.items():
+            old = old_timings.get(key)
+            if not key.endswith("_seconds") or old is None:
+                continue
+            if seconds > old*(1 + threshold) and seconds - old > min_seconds:
+                regressions.append((size, key, old, seconds))
+    return regressions
+
+def _suite_main(args):
+    suite = run_suite(args.sizes, args.repeat)
+    for size, timings in suite["results"].items():
+        print("--- {} items".format(size))
+        for key, value in timings.items():
+            print("{:<28}{}".format(key, value))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(suite, file, indent=2)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)
+    regressions = compare(baseline, suite, args.threshold)
+    for size, key, old, new in regressions:
+        print("REGRESSION {} items {}: {:.6f} s -> {:.6f} s ({:+.0%})".format(size, key, old, new, new/old - 1))
+    print("{} regressions against {}".format(len(regressions), args.baseline))
+    return 1 if regressions else 0
+
+
+
+BENCHMARKS = { "clusters": bench_clusters,
+               "export": bench_export,
+               "materialize": bench_materialize,
+               "memory": bench_memory,
+               "rotation": bench_rotation,
+               "spatial": bench_spatial,
+               "startup": bench_startup }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the Extended Liftoff Editor")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS) + ["suite"],
+                        help="benchmark to run, or suite to time the hot paths at several sizes")
+    parser.add_argument("-n", "--items", type=int, default=None, help="number of items (default depends on the benchmark)")
+    parser.add_argument("-o", "--output", default=None, help="write the results into this JSON file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SUITE_SIZES, help="suite: numbers of items")
+    parser.add_argument("--repeat", type=int, default=SUITE_REPEAT, help="suite: runs of each path, the fastest is kept")
+    parser.add_argument("--baseline", default=None, help="suite: JSON results to compare with, exit with 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="suite: tolerated slowdown")
+    args = parser.parse_args(argv)
+
+    if args.benchmark == "suite":
+        return _suite_main(args)
+
+    function = BENCHMARKS[args.benchmark]
+    result = function() if args.items is None else function(args.items)
+    for key, value in result.items():
+        print("{:<28}{}".format(key, value))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
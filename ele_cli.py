@@ -1,13 +1,12 @@
-import ele_program
+import sys
+import argparse
 
+import ele_program
+import ele_profile
 
 
-print("Loading models...")
 
 program = ele_program.Program()
-program.init()
-
-print("Done")
 
 
 
@@ -63,8 +62,8 @@ def show_instances():
         return
 
     print("                        X         Y         Z         Pitch     Yaw       Roll      ")
-    for i in range(len(program.instances)):
-        print("{} - {}".format(i, program.instances[i].pretty_print()))
+    for i, instance in enumerate(program.instances):
+        print("{} - {}".format(i, instance.pretty_print()))
 
 def set_instance_counter():
     try:
@@ -87,11 +86,13 @@ def load_project():
         print("The file contains invalid values for coordinates and angles")
 
 def save_project():
-    program.save_project(open("project.dat", "w"))
+    with open("project.dat", "w") as file:
+        program.save_project(file)
     print("Project saved into 'project.dat'")
 
 def generate_xml():
-    program.generate_xml(open("track.xml", "w"))
+    with open("track.xml", "w") as file:
+        program.generate_xml(file)
     print("Track saved into 'track.xml'")
 
 def quit():
@@ -107,25 +108,43 @@ commands = [list_blueprints,
             generate_xml,
             quit]
 
-print()
-print("Welcome to the Extended Liftoff Editor!")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extended Liftoff Editor")
+    parser.add_argument("--profile", default=None, help="report the time of each phase, for example log,json=timings.jsonl (see ele_profile)")
+    args = parser.parse_args(sys.argv[1:])
+    if args.profile is not None:
+        try:
+            ele_profile.configure(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # the blueprints may be parsed by a pool of processes, which import this module again on Windows
+    print("Loading models...")
+    program.init()
+    print("Done: {} blueprints in {:.2f} ms".format(len(program.load_report), sum(entry[2] for entry in program.load_report)*1000))
+    for file_name, _, _, _, error in program.load_report:
+        if error is not None:
+            print("Skipped {}: {}".format(file_name, error))
 
-while True:
     print()
-    print("1 - List available blueprints")
-    print("2 - Add instance")
-    print("3 - Remove instance")
-    print("4 - Show instances")
-    print("5 - Set instance counter")
-    print("6 - Load project")
-    print("7 - Save project")
-    print("8 - Generate XML")
-    print("9 - Quit")
+    print("Welcome to the Extended Liftoff Editor!")
+
+    while True:
+        print()
+        print("1 - List available blueprints")
+        print("2 - Add instance")
+        print("3 - Remove instance")
+        print("4 - Show instances")
+        print("5 - Set instance counter")
+        print("6 - Load project")
+        print("7 - Save project")
+        print("8 - Generate XML")
+        print("9 - Quit")
     
-    try:
-        prompt = int(input("> "))
-    except:
-        continue
+        try:
+            prompt = int(input("> "))
+        except:
+            continue
     
-    if prompt > 0 and prompt <= 9:
-        commands[int(prompt)-1]()
+        if prompt > 0 and prompt <= 9:
+            commands[int(prompt)-1]()
@@ -6,7 +6,8 @@
 
 import os
 import sys
-from PIL import Image, ImageTk
+import threading
+from PIL import ImageTk
 
 try:
     import Tkinter as tk
@@ -27,6 +28,9 @@ except ImportError:
 
 import ele_support
 import ele_program
+import ele_project
+import ele_listview
+import ele_history
 
 
 def vp_start_gui():
@@ -38,6 +42,9 @@ def vp_start_gui():
     ele_support.init(root, top)
     root.mainloop()
 
+# how often the window checks a background operation, in milliseconds
+POLL_INTERVAL = 50
+
 w = None
 def create_Toplevel(root, *args, **kwargs):
     '''Starting point when module is imported by another program.'''
@@ -260,7 +267,7 @@ class Toplevel:
         self.roll_spin.configure(selectforeground="black")
 
         self.add_instance_button = tk.Button(self.main_frame)
-        self.add_instance_button.place(relx=0.085, rely=0.926, height=24, width=123)
+        self.add_instance_button.place(relx=0.021, rely=0.926, height=24, width=123)
         self.add_instance_button.configure(activebackground="#ececec")
         self.add_instance_button.configure(activeforeground="#000000")
         self.add_instance_button.configure(background="#d9d9d9")
@@ -272,6 +279,19 @@ class Toplevel:
         self.add_instance_button.configure(text='''Add instance''')
         self.add_instance_button.configure(command=self.add_instance_handler)
 
+        self.move_instance_button = tk.Button(self.main_frame)
+        self.move_instance_button.place(relx=0.163, rely=0.926, height=24, width=123)
+        self.move_instance_button.configure(activebackground="#ececec")
+        self.move_instance_button.configure(activeforeground="#000000")
+        self.move_instance_button.configure(background="#d9d9d9")
+        self.move_instance_button.configure(disabledforeground="#a3a3a3")
+        self.move_instance_button.configure(foreground="#000000")
+        self.move_instance_button.configure(highlightbackground="#d9d9d9")
+        self.move_instance_button.configure(highlightcolor="black")
+        self.move_instance_button.configure(pady="0")
+        self.move_instance_button.configure(text='''Move instance''')
+        self.move_instance_button.configure(command=self.move_instance_handler)
+
         self.remove_instance_button = tk.Button(self.main_frame)
         self.remove_instance_button.place(relx=0.603, rely=0.926, height=24, width=110)
         self.remove_instance_button.configure(activebackground="#ececec")
@@ -286,17 +306,81 @@ class Toplevel:
         self.remove_instance_button.configure(width=110)
         self.remove_instance_button.configure(command=self.remove_instance_handler)
 
-        self.instance_list = tk.Listbox(self.main_frame)
-        self.instance_list.place(relx=0.328, rely=0.126, relheight=0.762, relwidth=0.66)
-        self.instance_list.configure(background="white")
-        self.instance_list.configure(disabledforeground="#a3a3a3")
-        self.instance_list.configure(font="TkFixedFont")
-        self.instance_list.configure(foreground="#000000")
-        self.instance_list.configure(highlightbackground="#d9d9d9")
-        self.instance_list.configure(highlightcolor="black")
-        self.instance_list.configure(selectbackground="#c4c4c4")
-        self.instance_list.configure(selectforeground="black")
-        self.instance_list.configure(width=624)
+        self.undo_button = tk.Button(self.main_frame)
+        self.undo_button.place(relx=0.328, rely=0.926, height=24, width=70)
+        self.undo_button.configure(activebackground="#ececec")
+        self.undo_button.configure(activeforeground="#000000")
+        self.undo_button.configure(background="#d9d9d9")
+        self.undo_button.configure(disabledforeground="#a3a3a3")
+        self.undo_button.configure(foreground="#000000")
+        self.undo_button.configure(highlightbackground="#d9d9d9")
+        self.undo_button.configure(highlightcolor="black")
+        self.undo_button.configure(pady="0")
+        self.undo_button.configure(text='''Undo''')
+        self.undo_button.configure(width=70)
+        self.undo_button.configure(command=self.undo_handler)
+
+        self.redo_button = tk.Button(self.main_frame)
+        self.redo_button.place(relx=0.41, rely=0.926, height=24, width=70)
+        self.redo_button.configure(activebackground="#ececec")
+        self.redo_button.configure(activeforeground="#000000")
+        self.redo_button.configure(background="#d9d9d9")
+        self.redo_button.configure(disabledforeground="#a3a3a3")
+        self.redo_button.configure(foreground="#000000")
+        self.redo_button.configure(highlightbackground="#d9d9d9")
+        self.redo_button.configure(highlightcolor="black")
+        self.redo_button.configure(pady="0")
+        self.redo_button.configure(text='''Redo''')
+        self.redo_button.configure(width=70)
+        self.redo_button.configure(command=self.redo_handler)
+
+        self.filter_label = tk.Label(self.main_frame)
+        self.filter_label.place(relx=0.328, rely=0.126, height=24, width=40)
+        self.filter_label.configure(background="#d9d9d9")
+        self.filter_label.configure(foreground="#000000")
+        self.filter_label.configure(text='''Filter''')
+
+        self.filter_entry = tk.Entry(self.main_frame)
+        self.filter_entry.place(relx=0.372, rely=0.126, height=24, relwidth=0.2)
+        self.filter_entry.configure(background="white")
+        self.filter_entry.configure(foreground="#000000")
+        self.filter_entry.bind('<KeyRelease>', lambda event: self.filter_handler())
+
+        self.sort_label = tk.Label(self.main_frame)
+        self.sort_label.place(relx=0.6, rely=0.126, height=24, width=50)
+        self.sort_label.configure(background="#d9d9d9")
+        self.sort_label.configure(foreground="#000000")
+        self.sort_label.configure(text='''Sort by''')
+
+        self.sort_combo = ttk.Combobox(self.main_frame)
+        self.sort_combo.place(relx=0.655, rely=0.126, height=24, relwidth=0.12)
+        self.sort_combo.configure(values=[column for column, _ in ele_listview.SORT_COLUMNS])
+        self.sort_combo.configure(state="readonly")
+        self.sort_combo.current(0)
+        self.sort_combo.bind('<<ComboboxSelected>>', lambda event: self.sort_handler())
+
+        self.descending = tk.BooleanVar(top, False)
+        self.descending_check = tk.Checkbutton(self.main_frame)
+        self.descending_check.place(relx=0.79, rely=0.126, height=24, width=100)
+        self.descending_check.configure(background="#d9d9d9")
+        self.descending_check.configure(activebackground="#d9d9d9")
+        self.descending_check.configure(foreground="#000000")
+        self.descending_check.configure(text='''Descending''')
+        self.descending_check.configure(variable=self.descending)
+        self.descending_check.configure(command=self.sort_handler)
+
+        # only the rows on screen are formatted and given to Tk, see ele_listview
+        self.instance_rows = ele_listview.InstanceRows()
+        self.instance_list = ele_listview.VirtualList(self.main_frame, self.instance_rows, command=self.select_instance_handler)
+        self.instance_list.place(relx=0.328, rely=0.189, relheight=0.699, relwidth=0.66)
+        self.instance_list.configure_listbox(background="white")
+        self.instance_list.configure_listbox(disabledforeground="#a3a3a3")
+        self.instance_list.configure_listbox(font="TkFixedFont")
+        self.instance_list.configure_listbox(foreground="#000000")
+        self.instance_list.configure_listbox(highlightbackground="#d9d9d9")
+        self.instance_list.configure_listbox(highlightcolor="black")
+        self.instance_list.configure_listbox(selectbackground="#c4c4c4")
+        self.instance_list.configure_listbox(selectforeground="black")
 
         self.load_project_button = tk.Button(self.main_frame)
         self.load_project_button.place(relx=0.021, rely=0.042, height=24, width=110)
@@ -339,16 +423,120 @@ class Toplevel:
         self.generate_xml_button.configure(text='''Generate XML''')
         self.generate_xml_button.configure(width=110)
         self.generate_xml_button.configure(command=self.generate_xml_handler)
+
+        self.merge_track_button = tk.Button(self.main_frame)
+        self.merge_track_button.place(relx=0.487, rely=0.042, height=24, width=110)
+        self.merge_track_button.configure(activebackground="#ececec")
+        self.merge_track_button.configure(activeforeground="#000000")
+        self.merge_track_button.configure(background="#d9d9d9")
+        self.merge_track_button.configure(disabledforeground="#a3a3a3")
+        self.merge_track_button.configure(foreground="#000000")
+        self.merge_track_button.configure(highlightbackground="#d9d9d9")
+        self.merge_track_button.configure(highlightcolor="black")
+        self.merge_track_button.configure(pady="0")
+        self.merge_track_button.configure(text='''Merge into track''')
+        self.merge_track_button.configure(width=110)
+        self.merge_track_button.configure(command=self.merge_track_handler)
+
+        self.status_label = tk.Label(self.main_frame)
+        self.status_label.place(relx=0.646, rely=0.042, height=24, relwidth=0.34)
+        self.status_label.configure(anchor='w')
+        self.status_label.configure(background="#d9d9d9")
+        self.status_label.configure(foreground="#000000")
+
+        self.progress_bar = ttk.Progressbar(self.main_frame)
+        self.progress_bar.place(relx=0.74, rely=0.926, height=24, relwidth=0.16)
+        self.progress_bar.configure(mode="determinate")
+
+        self.cancel_button = tk.Button(self.main_frame)
+        self.cancel_button.place(relx=0.91, rely=0.926, height=24, width=70)
+        self.cancel_button.configure(activebackground="#ececec")
+        self.cancel_button.configure(activeforeground="#000000")
+        self.cancel_button.configure(background="#d9d9d9")
+        self.cancel_button.configure(disabledforeground="#a3a3a3")
+        self.cancel_button.configure(foreground="#000000")
+        self.cancel_button.configure(highlightbackground="#d9d9d9")
+        self.cancel_button.configure(highlightcolor="black")
+        self.cancel_button.configure(pady="0")
+        self.cancel_button.configure(text='''Cancel''')
+        self.cancel_button.configure(state=tk.DISABLED)
+
+        self.top = top
+        # widgets disabled while an operation runs in background, see set_busy
+        self.busy_widgets = (self.add_instance_button, self.move_instance_button, self.remove_instance_button, self.load_project_button,
+                             self.save_project_button, self.generate_xml_button, self.merge_track_button,
+                             self.undo_button, self.redo_button, self.filter_entry, self.descending_check)
+        self.busy = False
+        top.bind('<Control-z>', self.undo_handler)
+        top.bind('<Control-y>', self.redo_handler)
         
         '''Initialize program'''
         self.program = ele_program.Program()
-        self.blueprint_combo['values'] = self.program.init()
+        self.run_in_background("Loading blueprints", self.program.init, self.init_done)
         
         # assign global variables for handling previews
         global program, canvas
         program = self.program
         canvas = self.blueprint_canvas
 
+    def init_done(self, names):
+        self.blueprint_combo['values'] = names
+        skipped = ["{}: {}".format(entry[0], entry[4]) for entry in self.program.load_report if entry[4] is not None]
+        if skipped:
+            messagebox.showwarning("Blueprints", "Some composite blueprints were skipped:\n" + "\n".join(skipped))
+
+    # Run a long operation in a worker thread, so that the window keeps responding.
+    # The operation receives the keyword argument progress, see ele_program.Cancelled, which moves the progress bar
+    # and stops the operation when Cancel is pressed. Widgets are only touched by this thread: the window checks
+    # the worker every POLL_INTERVAL milliseconds, and calls done(result) once it has finished.
+    def run_in_background(self, description, operation, done, *args):
+        cancelled = threading.Event()
+        state = { "progress": None, "result": None, "error": None, "finished": False }
+
+        def progress(done, total):
+            if cancelled.is_set():
+                raise ele_program.Cancelled()
+            state["progress"] = (done, total)
+
+        def worker():
+            try:
+                state["result"] = operation(*args, progress=progress)
+            except BaseException as e:
+                state["error"] = e
+            state["finished"] = True
+
+        def poll():
+            if not state["finished"]:
+                if state["progress"] is not None:
+                    completed, total = state["progress"]
+                    self.progress_bar.configure(mode="determinate", maximum=max(total, 1), value=completed)
+                self.top.after(POLL_INTERVAL, poll)
+                return
+            self.set_busy(False)
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate", value=0)
+            self.cancel_button.configure(state=tk.DISABLED)
+            if isinstance(state["error"], ele_program.Cancelled):
+                self.status_label.configure(text="{}: cancelled".format(description))
+            elif state["error"] is not None:
+                self.status_label.configure(text="{}: failed".format(description))
+                messagebox.showerror("Error", "{} failed: {}".format(description, state["error"]))
+            else:
+                self.status_label.configure(text="{}: done".format(description))
+                done(state["result"])
+
+        self.set_busy(True)
+        self.cancel_button.configure(state=tk.NORMAL, command=cancelled.set)
+        self.status_label.configure(text="{}...".format(description))
+        # until the first report of progress the bar just shows that something is going on
+        self.progress_bar.configure(mode="indeterminate")
+        self.progress_bar.start()
+        threading.Thread(target=worker, daemon=True).start()
+        self.top.after(POLL_INTERVAL, poll)
+
+    def placement_spins(self):
+        return (self.x_spin, self.y_spin, self.z_spin, self.pitch_spin, self.yaw_spin, self.roll_spin)
+
     def add_instance_handler(self):
         name  = self.blueprint_combo.get()
         x     = float(self.x_spin.get())
@@ -357,34 +545,134 @@ class Toplevel:
         pitch = float(self.pitch_spin.get())
         yaw   = float(self.yaw_spin.get())
         roll  = float(self.roll_spin.get())
-        new_instance = self.program.add_instance(name, x, y, z, pitch, yaw, roll)
-        self.instance_list.insert(tk.END, new_instance)
+        self.program.add_instance(name, x, y, z, pitch, yaw, roll)
+        self.instance_rows.insert((self.program.instances.handle(-1),), (self.program.instances[-1],))
+        self.instance_list.refresh()
         
     def remove_instance_handler(self):
-        index = self.instance_list.curselection()[0]
-        self.program.remove_instance(index)
-        self.instance_list.delete(tk.ACTIVE)
+        handle = self.instance_list.selected_instance()
+        if handle is None:
+            return
+        self.program.remove_instances((handle,))
+        self.instance_rows.remove((handle,))
+        self.instance_list.clear_selection()
+
+    # while an operation runs the instances may be replaced at any moment, so nothing touching them is allowed:
+    # the buttons, the instance list and its filter and sort are disabled
+    def set_busy(self, busy):
+        self.busy = busy
+        for widget in self.busy_widgets:
+            widget.configure(state=tk.DISABLED if busy else tk.NORMAL)
+        self.sort_combo.configure(state=tk.DISABLED if busy else "readonly")
+        self.instance_list.set_enabled(not busy)
+
+    # the placement of the selected instance goes into the spinboxes, ready to be changed and applied by Move instance
+    # a row still shown for an instance which is gone, for example while a project is loading, is ignored
+    def select_instance_handler(self, handle):
+        try:
+            instance = self.program.instances.get(handle)
+        except KeyError:
+            return
+        placement = (instance.pos_x, instance.pos_y, instance.pos_z, instance.rot_x, instance.rot_y, instance.rot_z)
+        for spin, value in zip(self.placement_spins(), placement):
+            spin.delete(0, tk.END)
+            spin.insert(0, str(round(value, 3)))
+
+    # only the items of the selected instance are computed again
+    def move_instance_handler(self):
+        handle = self.instance_list.selected_instance()
+        if handle is None:
+            return
+        placement = [float(spin.get()) for spin in self.placement_spins()]
+        self.program.update_instances((handle,), (placement,))
+        self.instance_rows.update((handle,), (self.program.instances.get(handle),))
+        self.instance_list.select_instance(handle)
+
+    # only the instances of the change undone or done again are added to the list or removed from it
+    # the shortcuts work even while the buttons are disabled, so they check that no operation is running
+    def undo_handler(self, event=None):
+        if not self.busy:
+            self.show_change(self.program.undo())
+
+    def redo_handler(self, event=None):
+        if not self.busy:
+            self.show_change(self.program.redo())
+
+    def show_change(self, change):
+        if change is None:
+            return
+        if change.kind == ele_history.UPDATE:
+            self.instance_rows.update(change.handles, change.instances)
+            self.instance_list.refresh()
+            return
+        if change.kind == ele_history.ADD:
+            self.instance_rows.insert(change.handles, change.instances)
+        else:
+            self.instance_rows.remove(change.handles)
+        self.instance_list.clear_selection()
+
+    def filter_handler(self):
+        self.instance_rows.set_filter(self.filter_entry.get())
+        self.instance_list.reset()
+
+    def sort_handler(self):
+        self.instance_rows.set_sort(self.sort_combo.get(), self.descending.get())
+        self.instance_list.reset()
 
     def load_project_handler(self):
-        file = filedialog.askopenfilename(initialdir=os.path.dirname(__file__), filetypes=(("Project files", "*.dat"), ("All files", "*.*")))
+        file = filedialog.askopenfilename(initialdir=os.path.dirname(__file__), filetypes=(("Project files", "*.dat *.elp"), ("All files", "*.*")))
         if file == "":
             return
-        instances = self.program.load_project(file)
-        self.instance_list.delete(0, tk.END)
-        for instance in instances:
-            self.instance_list.insert(tk.END, instance)
+        # the placements shown in the list are collected by the worker too
+        def load_project(file, progress):
+            self.program.load_project(file, progress=progress)
+            return self.program.placements() + (self.program.instances.handles(),)
+        self.run_in_background("Loading project", load_project, self.load_project_done, file)
+
+    def load_project_done(self, rows):
+        self.instance_rows.set_instances(*rows)
+        self.instance_list.reset()
 
     def save_project_handler(self):
-        file = filedialog.asksaveasfile(initialdir=os.path.dirname(__file__), mode='w', defaultextension=".dat", filetypes=(("Project file", "*.dat"),))
-        if file is None:
+        file = filedialog.asksaveasfilename(initialdir=os.path.dirname(__file__), defaultextension=".dat", filetypes=(("Project file", "*.dat"), ("Binary project file", "*.elp")))
+        if file == "":
             return
-        self.program.save_project(file)
+        if file.endswith(ele_project.BINARY_EXTENSION):
+            self.program.save_binary_project(file)
+        else:
+            with open(file, "w") as output:
+                self.program.save_project(output)
 
     def generate_xml_handler(self):
-        file = filedialog.asksaveasfile(initialdir=os.path.dirname(__file__), mode='w', defaultextension=".xml", filetypes=(("XML file", "*.xml"),))
-        if file is None:
+        file = filedialog.asksaveasfilename(initialdir=os.path.dirname(__file__), defaultextension=".xml", filetypes=(("XML file", "*.xml"),))
+        if file == "":
+            return
+        self.run_in_background("Generating XML", generate_xml, lambda removed: None, self.program, file)
+
+    # write the items into a track saved by Liftoff, replacing its items unless the user wants to keep them
+    def merge_track_handler(self):
+        file = filedialog.askopenfilename(initialdir=os.path.dirname(__file__), filetypes=(("Liftoff track", "*.xml"), ("All files", "*.*")))
+        if file == "":
             return
-        self.program.generate_xml(file)
+        append = messagebox.askyesno("Merge into track", "Keep the items already in the track?")
+        self.run_in_background("Merging into track", merge_track, lambda removed: None, self.program, file, append)
+
+# the track is replaced only once the new one is complete, see ele_track.merge_track
+def merge_track(program, path, append, progress):
+    return program.merge_xml(path, append=append, progress=progress)
+
+# write the track aside and rename it at the end, so that a cancelled export does not leave half a file
+def generate_xml(program, path, progress):
+    temporary = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temporary, "w") as output:
+            removed = program.generate_xml(output, progress=progress)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return removed
 
 # handler for canvas
 def onselect(evt):
@@ -393,7 +681,7 @@ def onselect(evt):
     value = evt.widget.get()
     canvas.delete("all")
     try:
-        img = program.previews[value].resize((canvas.winfo_width(), canvas.winfo_height()), Image.ANTIALIAS)
+        img = program.previews.thumbnail(value, canvas.winfo_width(), canvas.winfo_height())
         preview = ImageTk.PhotoImage(img)
         canvas.create_image(0, 0, image=preview, anchor=tk.NW)
     except:
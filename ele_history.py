@@ -0,0 +1,198 @@
+import json
+from collections import deque
+
+
+
+# number of changes which can be undone, older ones are forgotten
+UNDO_LIMIT = 100
+
+# kinds of change
+ADD = "add"
+REMOVE = "remove"
+UPDATE = "update"
+
+
+
+# The instances of a project, in the order they were added.
+# Each instance gets a handle when it is added, which stays the same until the store is cleared, so an instance can be
+# removed and put back in its place without moving the others. Removed instances leave a hole behind.
+# The store behaves as a list of the instances present, where an index counts only those.
+class InstanceStore:
+    def __init__(self, instances=()):
+        self.clear()
+        self.extend(instances)
+
+    def clear(self):
+        # instance of each handle, None once removed
+        self._slots = list()
+        self._count = 0
+        # handles of the instances present, rebuilt when needed if there are holes
+        self._present = None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        if self._count == len(self._slots):
+            return iter(self._slots)
+        return (instance for instance in self._slots if instance is not None)
+
+    def __getitem__(self, index):
+        if self._count == len(self._slots):
+            return self._slots[index]
+        if isinstance(index, slice):
+            return [self._slots[handle] for handle in self._handles()[index]]
+        return self._slots[self._handles()[index]]
+
+    def _handles(self):
+        if self._present is None:
+            self._present = [handle for handle, instance in enumerate(self._slots) if instance is not None]
+        return self._present
+
+    # handles of the instances present, in their order
+    def handles(self):
+        if self._count == len(self._slots):
+            return list(range(self._count))
+        return list(self._handles())
+
+    # handle of the instance at an index
+    # @raise IndexError if there is no such instance
+    def handle(self, index):
+        if self._count == len(self._slots):
+            return range(self._count)[index]
+        return self._handles()[index]
+
+    # @raise KeyError if the handle was removed or never given
+    def get(self, handle):
+        instance = self._slots[handle] if 0 <= handle < len(self._slots) else None
+        if instance is None:
+            raise KeyError(handle)
+        return instance
+
+    # @return the handle of the new instance
+    def append(self, instance):
+        return self.extend((instance,))[0]
+
+    # @return the handles of the new instances
+    def extend(self, instances):
+        start = len(self._slots)
+        self._slots.extend(instances)
+        added = len(self._slots) - start
+        self._count += added
+        if self._present is not None:
+            self._present.extend(range(start, start + added))
+        return range(start, start + added)
+
+    # @return the instance removed
+    # @raise KeyError if the handle was removed or never given
+    def remove(self, handle):
+        instance = self.get(handle)
+        self._slots[handle] = None
+        self._count -= 1
+        self._present = None
+        return instance
+
+    # put back a removed instance in its place
+    def restore(self, handle, instance):
+        if self._slots[handle] is not None:
+            raise KeyError(handle)
+        self._slots[handle] = instance
+        self._count += 1
+        self._present = None
+
+
+
+# Instances added, removed or moved together by a single operation. Changes hold the instances themselves, so undoing
+# or redoing one only puts them back or takes them out of the store, together with their instance IDs (see ele_ids).
+# Moved instances also keep their states before and after the move, see Blueprint.state, which are put back as they are.
+class Change:
+    def __init__(self, kind, handles, instances, states=None):
+        self.kind = kind
+        self.handles = list(handles)
+        self.instances = list(instances)
+        self.states = states
+
+    # the change which cancels this one
+    def inverse(self):
+        kind = { ADD: REMOVE, REMOVE: ADD, UPDATE: UPDATE }[self.kind]
+        states = None if self.states is None else (self.states[1], self.states[0])
+        return Change(kind, self.handles, self.instances, states)
+
+class History:
+    def __init__(self, limit=UNDO_LIMIT):
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
+        self._done = deque(maxlen=self.limit)
+        self._undone = list()
+
+    # remember a change just made, which can no longer be followed by the ones undone before
+    def record(self, change):
+        self._done.append(change)
+        self._undone.clear()
+
+    def can_undo(self):
+        return bool(self._done)
+
+    def can_redo(self):
+        return bool(self._undone)
+
+    # @return the change to apply to undo the last one, or None if there is nothing to undo
+    def undo(self):
+        if not self._done:
+            return None
+        change = self._done.pop()
+        self._undone.append(change)
+        return change.inverse()
+
+    # @return the change to apply again, or None if there is nothing to redo
+    def redo(self):
+        if not self._undone:
+            return None
+        change = self._undone.pop()
+        self._done.append(change)
+        return change
+
+
+
+'''
+The journal is a text file where every operation changing the instances appends a JSON object on its own line, so
+that after a crash the project can be rebuilt by doing the same operations again (see Program.replay_journal):
+
+{"op": "load", "project": <path>}                           the project file was loaded
+{"op": "add", "names": [...], "placements": [[...]]}        instances were added
+{"op": "remove", "handles": [...]}                          instances were removed
+{"op": "update", "handles": [...], "placements": [[...]]}   instances were moved
+{"op": "reserve", "value": <n>}                             instance IDs up to n were reserved
+{"op": "compact"}                                           instance IDs were numbered again
+{"op": "undo"}, {"op": "redo"}
+
+Instance IDs are given out the same way when the operations are done again, so they are not recorded.
+
+Lines are flushed as they are written. A line cut by a crash is ignored when reading.
+'''
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# @return the records of a journal, in order
+def read_journal(path):
+    records = list()
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # the last line may be incomplete
+                break
+    return records
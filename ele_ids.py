@@ -0,0 +1,150 @@
+import bisect
+
+import numpy as np
+
+
+
+# Gives out the instance IDs of the items. Each instance takes a block of consecutive IDs, one per item.
+#
+# IDs up to floor are used by something else, usually the items already in the track, and are never given out.
+# A block given back is joined with the free blocks right before and after it, and a block given back at the top simply
+# lowers it. A new block is taken from a free block of the same size, otherwise it is cut from the smallest free block
+# large enough, whose rest stays free, and only otherwise from the top. So removing and adding instances, even of
+# different blueprints, does not make the IDs grow.
+class IdAllocator:
+    def __init__(self, floor=0):
+        self.floor = floor
+        self.clear()
+
+    # forget every block, the next one starts right after floor
+    def clear(self):
+        self.next = self.floor + 1
+        # starts of the free blocks of each size, as dictionaries used as ordered sets
+        self._free = dict()
+        # size of the free block starting at each ID, and start of the free block ending before each ID
+        self._starts = dict()
+        self._ends = dict()
+        # sizes of the free blocks and their starts, sorted, to find the smallest block large enough and the block
+        # holding an ID
+        self._sizes = list()
+        self._sorted_starts = list()
+
+    def copy(self):
+        copied = IdAllocator(self.floor)
+        copied.next = self.next
+        copied._free = { n: dict(starts) for n, starts in self._free.items() }
+        copied._starts = dict(self._starts)
+        copied._ends = dict(self._ends)
+        copied._sizes = list(self._sizes)
+        copied._sorted_starts = list(self._sorted_starts)
+        return copied
+
+    # highest ID given out, or floor, which is the lastTrackItemID of the track
+    @property
+    def last(self):
+        return self.next - 1
+
+    def _link(self, start, n):
+        if n not in self._free:
+            self._free[n] = dict()
+            bisect.insort(self._sizes, n)
+        self._free[n][start] = None
+        self._starts[start] = n
+        self._ends[start + n] = start
+        bisect.insort(self._sorted_starts, start)
+
+    # @return size of the block
+    def _unlink(self, start):
+        n = self._starts.pop(start)
+        del self._ends[start + n]
+        del self._free[n][start]
+        if not self._free[n]:
+            del self._free[n]
+            del self._sizes[bisect.bisect_left(self._sizes, n)]
+        del self._sorted_starts[bisect.bisect_left(self._sorted_starts, start)]
+        return n
+
+    # @return the first ID of a new block of n IDs
+    def allocate(self, n):
+        if n in self._free:
+            start = next(iter(self._free[n]))
+            self._unlink(start)
+            return start
+        larger = bisect.bisect_right(self._sizes, n)
+        if n and larger < len(self._sizes):
+            size = self._sizes[larger]
+            start = next(iter(self._free[size]))
+            self._unlink(start)
+            self._link(start + n, size - n)
+            return start
+        start = self.next
+        self.next += n
+        return start
+
+    # allocate a block for each size, in order
+    # @return array with the first ID of each block
+    def allocate_many(self, sizes):
+        sizes = np.asarray(sizes, dtype=np.int64)
+        if self._starts:
+            return np.array([self.allocate(n) for n in sizes.tolist()], dtype=np.int64)
+        # without free blocks all of them are taken from the top at once
+        starts = self.next + np.cumsum(sizes) - sizes
+        self.next += int(sizes.sum())
+        return starts
+
+    # give back the block of n IDs starting at start
+    def free(self, start, n):
+        if n == 0:
+            return
+        # free blocks are never next to each other or to the top, so there is at most one on each side
+        if start in self._ends:
+            before = self._ends[start]
+            n += self._unlink(before)
+            start = before
+        if start + n in self._starts:
+            n += self._unlink(start + n)
+        if start + n == self.next:
+            self.next = start
+        else:
+            self._link(start, n)
+
+    # take a given block, if it is free, for example to put back a removed instance with its IDs
+    # @return False if some of the IDs are in use
+    def take(self, start, n):
+        if n == 0:
+            return True
+        if start >= self.next:
+            if start > self.next:
+                self._link(self.next, start - self.next)
+            self.next = start + n
+            return True
+        # the block may have been joined with other free blocks, which keep the rest
+        holder = bisect.bisect_right(self._sorted_starts, start) - 1
+        if holder < 0:
+            return False
+        begin = self._sorted_starts[holder]
+        end = begin + self._starts[begin]
+        if start + n > end:
+            return False
+        self._unlink(begin)
+        if start > begin:
+            self._link(begin, start - begin)
+        if end > start + n:
+            self._link(start + n, end - start - n)
+        return True
+
+    # IDs up to floor are used by something else from now on
+    # free blocks below it are dropped and those reaching above it keep their part above, blocks in use are left as
+    # they are
+    def reserve(self, floor):
+        self.floor = floor
+        for start, n in list(self._starts.items()):
+            if start <= floor:
+                self._unlink(start)
+                if start + n > floor + 1:
+                    self._link(floor + 1, start + n - floor - 1)
+        self.next = max(self.next, floor + 1)
+
+    # number of the IDs kept in free blocks, which compacting the IDs would save
+    def free_count(self):
+        return sum(self._starts.values())
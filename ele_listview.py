@@ -0,0 +1,250 @@
+import numpy as np
+
+try:
+    import Tkinter as tk
+    import tkFont as tkfont
+except ImportError:
+    import tkinter as tk
+    import tkinter.font as tkfont
+
+import ele_utils
+
+
+
+# columns the instances can be sorted by, with their index in the placements (None keeps the order they were added)
+SORT_COLUMNS = (("Order", None), ("Name", None), ("X", 0), ("Y", 1), ("Z", 2), ("Pitch", 3), ("Yaw", 4), ("Roll", 5))
+
+# rows moved by a click on the arrows of the scrollbar or a step of the mouse wheel
+SCROLL_STEP = 3
+
+
+
+# The rows of the instance list, as names and placements of the instances plus the order in which they are shown.
+# Only the rows on screen are ever formatted, so the cost of showing the list does not grow with the project.
+# Instances are known by their handle in Program.instances, and kept in the same order.
+class InstanceRows:
+    def __init__(self):
+        self.names = list()
+        self.placements = np.zeros((0, 6))
+        self.handles = np.zeros(0, dtype=np.int64)
+        self.filter_text = ""
+        self.sort_column = "Order"
+        self.descending = False
+        # index of the instance shown in each row
+        self.view = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.view)
+
+    # show the given instances, replacing the current ones
+    # @param names, placements = as returned by Program.placements
+    # @param handles = as returned by Program.instances.handles
+    def set_instances(self, names, placements, handles):
+        self.names = list(names)
+        self.placements = np.asarray(placements, dtype=float).reshape(-1, 6)
+        self.handles = np.asarray(handles, dtype=np.int64)
+        self.update_view()
+
+    # add instances, wherever their handles place them
+    def insert(self, handles, instances):
+        names = self.names + [instance.name for instance in instances]
+        placements = [(instance.pos_x, instance.pos_y, instance.pos_z, instance.rot_x, instance.rot_y, instance.rot_z)
+                      for instance in instances]
+        handles = np.concatenate((self.handles, np.asarray(handles, dtype=np.int64)))
+        order = np.argsort(handles, kind="stable")
+        self.names = [names[k] for k in order.tolist()]
+        self.placements = np.vstack((self.placements, np.reshape(placements, (-1, 6))))[order]
+        self.handles = handles[order]
+        self.update_view()
+
+    # show the new placement of moved instances
+    def update(self, handles, instances):
+        rows = np.searchsorted(self.handles, np.asarray(handles, dtype=np.int64))
+        self.placements[rows] = [(instance.pos_x, instance.pos_y, instance.pos_z, instance.rot_x, instance.rot_y, instance.rot_z)
+                                 for instance in instances]
+        self.update_view()
+
+    def remove(self, handles):
+        keep = ~np.isin(self.handles, np.asarray(handles, dtype=np.int64))
+        self.names = [name for name, kept in zip(self.names, keep.tolist()) if kept]
+        self.placements = self.placements[keep]
+        self.handles = self.handles[keep]
+        self.update_view()
+
+    # show only the instances whose blueprint name contains text, ignoring case
+    def set_filter(self, text):
+        self.filter_text = text
+        self.update_view()
+
+    def set_sort(self, column, descending=False):
+        self.sort_column = column
+        self.descending = descending
+        self.update_view()
+
+    def update_view(self):
+        indices = np.arange(len(self.names))
+        if self.filter_text:
+            text = self.filter_text.lower()
+            # each blueprint name is matched once, however many instances it has
+            matches = { name: text in name.lower() for name in set(self.names) }
+            indices = indices[np.array([matches[name] for name in self.names], dtype=bool)]
+
+        column = dict(SORT_COLUMNS)[self.sort_column]
+        if self.sort_column == "Name":
+            names = np.array(self.names, dtype=str)[indices]
+            indices = indices[np.argsort(names, kind="stable")]
+        elif column is not None:
+            indices = indices[np.argsort(self.placements[indices, column], kind="stable")]
+        if self.descending:
+            indices = indices[::-1]
+        self.view = indices
+
+    # handle of the instance shown in a row
+    def instance_handle(self, row):
+        return int(self.handles[self.view[row]])
+
+    # row showing an instance, or None if it is filtered out
+    def row_of(self, handle):
+        rows = np.flatnonzero(self.handles[self.view] == handle)
+        return int(rows[0]) if len(rows) else None
+
+    # text of the rows from start to stop
+    def rows(self, start, stop):
+        indices = self.view[start:stop].tolist()
+        placements = self.placements[indices].tolist()
+        return [ele_utils.format_placement(self.names[index], *placement) for index, placement in zip(indices, placements)]
+
+
+
+# A list showing the rows of an InstanceRows. The listbox inside holds only the rows that fit on screen,
+# and scrolling replaces their text, so showing or scrolling a list of any length takes the same time.
+# command, if given, receives the handle of the instance selected by the user.
+class VirtualList(tk.Frame):
+    def __init__(self, master, rows, command=None, **options):
+        tk.Frame.__init__(self, master, **options)
+        self.rows = rows
+        self.command = command
+        # first row shown, and the row selected if any
+        self.first = 0
+        self.selected = None
+        self._row_height = None
+        # a disabled list still scrolls, but its selection does not change
+        self.enabled = True
+
+        self.listbox = tk.Listbox(self, activestyle="none", exportselection=False)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.listbox.bind("<Configure>", lambda event: self.refresh())
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<MouseWheel>", lambda event: self.scroll(-SCROLL_STEP if event.delta > 0 else SCROLL_STEP))
+        self.listbox.bind("<Button-4>", lambda event: self.scroll(-SCROLL_STEP))
+        self.listbox.bind("<Button-5>", lambda event: self.scroll(SCROLL_STEP))
+        self.listbox.bind("<Up>", lambda event: self._move_selection(-1))
+        self.listbox.bind("<Down>", lambda event: self._move_selection(1))
+        self.listbox.bind("<Prior>", lambda event: self.scroll(-self.visible_rows()))
+        self.listbox.bind("<Next>", lambda event: self.scroll(self.visible_rows()))
+
+    def configure_listbox(self, **options):
+        self.listbox.configure(**options)
+        self._row_height = None
+
+    # number of rows which fit in the listbox
+    def visible_rows(self):
+        if self._row_height is None:
+            self._row_height = tkfont.Font(font=self.listbox.cget("font")).metrics("linespace") + 1
+        height = self.listbox.winfo_height() - 2*int(self.listbox.cget("borderwidth"))
+        return max(1, height // self._row_height)
+
+    # show the rows again, after they have changed
+    def refresh(self):
+        visible = self.visible_rows()
+        self.first = max(0, min(self.first, len(self.rows) - visible))
+        # a disabled listbox ignores insert and delete
+        if not self.enabled:
+            self.listbox.configure(state=tk.NORMAL)
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *self.rows.rows(self.first, self.first + visible))
+        if self.selected is not None and self.first <= self.selected < self.first + visible:
+            self.listbox.selection_set(self.selected - self.first)
+        if not self.enabled:
+            self.listbox.configure(state=tk.DISABLED)
+        if len(self.rows) <= visible:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.first / len(self.rows), (self.first + visible) / len(self.rows))
+
+    def scroll(self, rows):
+        self.first += rows
+        self.refresh()
+        return "break"
+
+    # command of the scrollbar
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.first = int(float(args[1])*len(self.rows))
+        elif args[0] == "scroll":
+            step = self.visible_rows() if args[2] == "pages" else SCROLL_STEP
+            self.first += int(args[1])*step
+        self.refresh()
+
+    # for example while the instances are being loaded
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.listbox.configure(state=tk.NORMAL if enabled else tk.DISABLED)
+
+    def _on_select(self, event):
+        selection = self.listbox.curselection()
+        if selection and self.enabled:
+            self.selected = self.first + selection[0]
+            self._notify()
+
+    def _notify(self):
+        handle = self.selected_instance()
+        if self.command is not None and handle is not None:
+            self.command(handle)
+
+    def _move_selection(self, rows):
+        if not self.enabled:
+            return "break"
+        if self.selected is None:
+            self.selected = self.first
+        else:
+            self.selected = max(0, min(self.selected + rows, len(self.rows) - 1))
+        self._show_selected()
+        self._notify()
+        return "break"
+
+    # scroll until the selected row is on screen
+    def _show_selected(self):
+        visible = self.visible_rows()
+        if self.selected < self.first:
+            self.first = self.selected
+        elif self.selected >= self.first + visible:
+            self.first = self.selected - visible + 1
+        self.refresh()
+
+    # select the row of an instance, for example after it was moved and the rows were sorted again
+    def select_instance(self, handle):
+        self.selected = self.rows.row_of(handle)
+        if self.selected is None:
+            self.refresh()
+        else:
+            self._show_selected()
+
+    # handle of the selected instance, as in Program.instances, or None
+    def selected_instance(self):
+        if self.selected is None or self.selected >= len(self.rows):
+            return None
+        return self.rows.instance_handle(self.selected)
+
+    # forget the selection, for example after the selected row is removed
+    def clear_selection(self):
+        self.selected = None
+        self.refresh()
+
+    # forget the selection and show the first rows, after the rows are filtered or sorted again
+    def reset(self):
+        self.first = 0
+        self.clear_selection()
@@ -0,0 +1,355 @@
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import ele_utils
+import ele_project
+import ele_profile
+from ele_rotation import local_euler_to_quat_array
+
+
+
+# folder with the XML code and the preview of each blueprint
+BLUEPRINTS_DIRECTORY = "./blueprints"
+
+# compiled blueprints are stored in this subfolder of the blueprints folder, in a single NumPy archive
+CACHE_DIRECTORY = ".cache"
+CACHE_FILE = "library.npz"
+
+# a composite blueprint is a project saved in the blueprints folder: its instances, placed around its center,
+# are themselves blueprints, possibly composite ones
+COMPOSITE_EXTENSION = ".dat"
+
+# bump when the content of the archives changes, so that old caches are rebuilt
+CACHE_VERSION = 1
+
+# below this number of files the blueprints are parsed in this process, starting a pool would take longer
+PARALLEL_MIN_FILES = 32
+
+
+
+'''
+Structure of the XML model (note the XSD declaration in the root tag, not present in Liftoff files but required here for parsing)
+
+<blueprints xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <TrackBlueprint xsi:type="TrackBlueprintFlag">
+    <itemID>...</itemID>
+    <instanceID>...</instanceID>
+    <position>
+      <x>...</x>
+      <y>...</y>
+      <z>...</z>
+    </position>
+    <rotation>
+      <x>...</x>
+      <y>...</y>
+      <z>...</z>
+    </rotation>
+    <purpose>Functional</purpose>
+  </TrackBlueprint>
+</blueprints>
+'''
+
+def _vector(element):
+    return (float(element.findtext("x")), float(element.findtext("y")), float(element.findtext("z")))
+
+# parse the items of a blueprint file, or of a whole Liftoff track, into arrays
+# the file is read incrementally and every TrackBlueprint is discarded once read, so the tree is never built
+# items without a position or a rotation are skipped
+# @param source = path or file object of the XML code
+# @return (item_ids, instance_ids, positions, rotations, quats) where the arrays have one row per item
+def parse_items(source):
+    item_ids = list()
+    instance_ids = list()
+    positions = list()
+    rotations = list()
+
+    # the items are children of the "blueprints" tag, which is the root of a blueprint file
+    # and a child of the root in a track file
+    container = None
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if container is None or element.tag == "blueprints":
+                container = element
+            continue
+        if element.tag != "TrackBlueprint":
+            continue
+        position = element.find("position")
+        rotation = element.find("rotation")
+        if position is not None and rotation is not None:
+            item_ids.append(element.findtext("itemID"))
+            instance_ids.append(int(element.findtext("instanceID")))
+            positions.append(_vector(position))
+            rotations.append(_vector(rotation))
+        # drop the items already read
+        container.clear()
+
+    positions = np.array(positions, dtype=float).reshape(-1, 3)
+    rotations = np.array(rotations, dtype=float).reshape(-1, 3)
+    # initial orientation is based on LOCAL axis
+    quats = local_euler_to_quat_array(rotations).reshape(-1, 4)
+    return (item_ids, np.array(instance_ids, dtype=np.int64), positions, rotations, quats)
+
+# build a blueprint from the arrays returned by parse_items
+def make_blueprint(name, arrays):
+    blueprint = ele_utils.Blueprint(name)
+    blueprint.items = ele_utils.ItemTable.from_arrays(*arrays)
+    # offsets and quaternions of the items are computed once here and shared by every instance
+    blueprint.build_cache()
+    return blueprint
+
+# items of a composite blueprint, moved to world space once so that its instances are created as any other blueprint
+# @param names = name of the blueprint of each child
+# @param placements = array of shape (K, 6) with x, y, z, pitch, yaw, roll of each child around the center
+# @param blueprints = dictionary containing the blueprint of each child
+# @return the arrays of the items, as returned by parse_items
+# @raise KeyError if a child does not exist
+def flatten(names, placements, blueprints):
+    placements = np.asarray(placements, dtype=float).reshape(-1, 6)
+    groups = dict()
+    for k, name in enumerate(names):
+        groups.setdefault(name, list()).append(k)
+
+    # the children are placed in batches, one for each blueprint, and then put back in their order
+    children = [None]*len(names)
+    for name, indices in groups.items():
+        for k, child in zip(indices, blueprints[name].instantiate_many(placements[indices])):
+            children[k] = child.items
+
+    item_ids = [item_id for items in children for item_id in items.item_ids]
+    return (item_ids,
+            np.arange(1, len(item_ids) + 1, dtype=np.int64),
+            np.concatenate([items.positions for items in children] + [np.zeros((0, 3))]),
+            np.concatenate([items.rotations for items in children] + [np.zeros((0, 3))]),
+            np.concatenate([items.quats for items in children] + [np.zeros((0, 4))]))
+
+# flatten the composite blueprints, each one after the blueprints it contains
+# @param composites = dictionary mapping each name to (mtime, size, names, placements) as read from its file
+# @param blueprints = blueprints already loaded, the composite ones are added to it
+# @param cache = compiled library, see read_cache
+# @param changed = names of the blueprints not read from the cache, the composite ones are added to it
+#                  a composite is read from the cache only if neither its file nor any of its children changed
+# @param errors = dictionary mapping the name of each composite which cannot be loaded to the reason,
+#                 the ones which contain itself, a blueprint which does not exist or a skipped composite are added to it
+# @return dictionary mapping each composite name to (arrays, seconds, read from cache), skipped ones excluded
+def load_composites(composites, blueprints, cache, changed, errors=None):
+    results = dict()
+    errors = dict() if errors is None else errors
+
+    def resolve(name, parents):
+        if name in results:
+            return
+        if name in parents:
+            raise ValueError("composite blueprint {} contains itself".format(name))
+        mtime, size, children, placements = composites[name]
+        for child in children:
+            if child in errors:
+                raise ValueError("composite blueprint {} contains {}, which cannot be loaded".format(name, child))
+            if child in composites:
+                resolve(child, parents + (name,))
+            elif child not in blueprints:
+                raise ValueError("composite blueprint {} contains {}, which does not exist".format(name, child))
+
+        start = time.perf_counter()
+        entry = cache.get(name)
+        cached = entry is not None and entry[0] == mtime and entry[1] == size and changed.isdisjoint(children)
+        if cached:
+            arrays = entry[2]
+        else:
+            arrays = flatten(children, placements, blueprints)
+            changed.add(name)
+        blueprints[name] = make_blueprint(name, arrays)
+        results[name] = (arrays, time.perf_counter() - start, cached)
+
+    # a bad composite is skipped, the others are loaded anyway
+    for name in composites:
+        if name not in results and name not in errors:
+            try:
+                resolve(name, ())
+            except ValueError as e:
+                errors[name] = str(e)
+    return results
+
+# The compiled library holds the items of all the blueprints one after the other:
+# - names, mtimes and sizes describe the source file of each blueprint
+# - the items of the i-th blueprint are the rows from starts[i] to starts[i+1] of the item arrays
+# A blueprint is read from it only if its source still has the same mtime and size.
+
+def _cache_path(directory):
+    return os.path.join(directory, CACHE_DIRECTORY, CACHE_FILE)
+
+# read the compiled library of a folder
+# @return dictionary mapping each name to (mtime, size, arrays), empty if the cache is missing or unreadable
+def read_cache(directory):
+    try:
+        with np.load(_cache_path(directory), allow_pickle=False) as archive:
+            if int(archive["version"]) != CACHE_VERSION:
+                return dict()
+            columns = [archive[key] for key in ("item_ids", "instance_ids", "positions", "rotations", "quats")]
+            names, mtimes, sizes, starts = archive["names"], archive["mtimes"], archive["sizes"], archive["starts"]
+    except (OSError, KeyError, ValueError):
+        return dict()
+
+    entries = dict()
+    for i, name in enumerate(names.tolist()):
+        begin, end = starts[i], starts[i+1]
+        item_ids = columns[0][begin:end].tolist()
+        arrays = (item_ids,) + tuple(column[begin:end] for column in columns[1:])
+        entries[name] = (int(mtimes[i]), int(sizes[i]), arrays)
+    return entries
+
+# store the compiled library of a folder, the archive is written aside and then renamed so readers never see half of it
+# a folder which cannot be written just means no cache
+# @param entries = dictionary mapping each name to (mtime, size, arrays)
+def write_cache(directory, entries):
+    names = list(entries)
+    all_arrays = [entries[name][2] for name in names]
+    starts = np.cumsum([0] + [len(arrays[0]) for arrays in all_arrays])
+    target = _cache_path(directory)
+    temporary = "{}.{}.tmp".format(target, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(temporary, "wb") as file:
+            np.savez(file,
+                     version=CACHE_VERSION,
+                     names=np.array(names, dtype=str),
+                     mtimes=np.array([entries[name][0] for name in names], dtype=np.int64),
+                     sizes=np.array([entries[name][1] for name in names], dtype=np.int64),
+                     starts=starts,
+                     item_ids=np.array([item_id for arrays in all_arrays for item_id in arrays[0]], dtype=str),
+                     instance_ids=np.concatenate([arrays[1] for arrays in all_arrays] + [np.zeros(0, dtype=np.int64)]),
+                     positions=np.concatenate([arrays[2] for arrays in all_arrays] + [np.zeros((0, 3))]),
+                     rotations=np.concatenate([arrays[3] for arrays in all_arrays] + [np.zeros((0, 3))]),
+                     quats=np.concatenate([arrays[4] for arrays in all_arrays] + [np.zeros((0, 4))]))
+        os.replace(temporary, target)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+# parse a blueprint file, this runs inside the worker processes
+# @return (name, arrays, seconds)
+def _load_file(path):
+    start = time.perf_counter()
+    arrays = parse_items(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return (name, arrays, time.perf_counter() - start)
+
+# load all the blueprints found in a folder
+# @param directory = folder containing the XML files
+# @param workers = number of processes parsing the files, 1 parses them in this process
+#                  by default a pool with one process per core is used for large libraries
+# @param use_cache = read the compiled blueprints when up to date, and compile the others
+# @param progress = called as progress(done, total) after each file parsed, it may raise an exception to stop loading
+# @return (blueprints, report) where blueprints maps each name to its Blueprint
+#         and report is a list of (file name, number of items, seconds, read from cache, error) in the same order,
+#         where error is None or tells why a composite blueprint was skipped, see load_composites
+def load_library(directory=BLUEPRINTS_DIRECTORY, workers=None, use_cache=True, progress=None):
+    files = os.listdir(directory)
+    paths = [os.path.join(directory, xml_file) for xml_file in files if xml_file.endswith(".xml")]
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    stats = [os.stat(path) for path in paths]
+
+    # a composite blueprint with the same name as an XML one is ignored
+    composite_paths = [os.path.join(directory, composite_file) for composite_file in files
+                       if composite_file.endswith(COMPOSITE_EXTENSION) and composite_file[:-len(COMPOSITE_EXTENSION)] not in names]
+    composites = dict()
+    errors = dict()
+    for path in composite_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        stat = os.stat(path)
+        try:
+            composites[name] = (stat.st_mtime_ns, stat.st_size) + ele_project.read_text(path)
+        except ValueError as e:
+            errors[name] = str(e)
+
+    with ele_profile.phase("read cache"):
+        cache = read_cache(directory) if use_cache else dict()
+    loaded = dict()
+    timings = dict()
+    for name, stat in zip(names, stats):
+        start = time.perf_counter()
+        entry = cache.get(name)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            loaded[name] = entry[2]
+            timings[name] = time.perf_counter() - start
+    cached = set(loaded)
+    stale = [path for path, name in zip(paths, names) if name not in cached]
+
+    if workers is None:
+        workers = 1 if len(stale) < PARALLEL_MIN_FILES else os.cpu_count()
+    if workers <= 1:
+        results = map(_load_file, stale)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_load_file, stale, chunksize=max(1, len(stale) // (4*workers)))
+    try:
+        with ele_profile.phase("parse"):
+            for done, (name, arrays, seconds) in enumerate(results, 1):
+                loaded[name] = arrays
+                timings[name] = seconds
+                if progress is not None:
+                    progress(done, len(stale))
+    finally:
+        if workers > 1:
+            executor.shutdown()
+
+    blueprints = dict()
+    report = list()
+    with ele_profile.phase("build"):
+        for path, name in zip(paths, names):
+            blueprints[name] = make_blueprint(name, loaded[name])
+            report.append((os.path.basename(path), len(loaded[name][0]), timings[name], name in cached, None))
+
+    changed = set(names) - cached
+    with ele_profile.phase("flatten"):
+        flattened = load_composites(composites, blueprints, cache, changed, errors)
+    for path in composite_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in errors:
+            report.append((os.path.basename(path), 0, 0.0, False, errors[name]))
+            continue
+        arrays, seconds, from_cache = flattened[name]
+        report.append((os.path.basename(path), len(arrays[0]), seconds, from_cache, None))
+
+    # the cache is rewritten only when some file was added, changed or removed
+    if use_cache and (changed or len(cache) != len(names) + len(flattened)):
+        entries = { name: (stat.st_mtime_ns, stat.st_size, loaded[name]) for name, stat in zip(names, stats) }
+        entries.update({ name: (composites[name][0], composites[name][1], flattened[name][0]) for name in flattened })
+        with ele_profile.phase("write cache"):
+            write_cache(directory, entries)
+
+    ele_profile.count("files", len(report))
+    ele_profile.count("parsed", len(stale))
+    ele_profile.count("items", sum(entry[1] for entry in report))
+    return blueprints, report
+
+# human readable timing of each file, slowest first
+def format_report(report):
+    lines = list()
+    for file_name, n_items, seconds, cached, error in sorted(report, key=lambda entry: -entry[2]):
+        if error is not None:
+            lines.append("{}SKIPPED: {}".format(file_name.ljust(40, ' '), error))
+            continue
+        source = "cache" if cached else "xml"
+        lines.append("{}{}{}{:.2f} ms".format(file_name.ljust(40, ' '), str(n_items).ljust(10, ' '), source.ljust(8, ' '), seconds*1000))
+    total = sum(entry[2] for entry in report)
+    n_cached = sum(1 for entry in report if entry[3])
+    n_skipped = sum(1 for entry in report if entry[4] is not None)
+    lines.append("{} files ({} from cache, {} skipped), {} items, {:.2f} ms of loading".format(len(report), n_cached, n_skipped, sum(entry[1] for entry in report), total*1000))
+    return '\n'.join(lines)
+
+
+
+if __name__ == '__main__':
+    arguments = [argument for argument in sys.argv[1:] if argument != "--no-cache"]
+    directory = arguments[0] if arguments else BLUEPRINTS_DIRECTORY
+    start = time.perf_counter()
+    blueprints, report = load_library(directory, use_cache="--no-cache" not in sys.argv)
+    print(format_report(report))
+    print("Loaded in {:.2f} ms".format((time.perf_counter() - start)*1000))
@@ -0,0 +1,131 @@
+import numpy as np
+
+from ele_rotation import local_euler_to_quat_array, quat_to_global_euler_array
+
+
+
+# Placements of procedural patterns of instances.
+# Every function returns an array of shape (K, 6) with x, y, z, pitch, yaw, roll of each instance,
+# in the form taken by Program.add_instances, so a whole pattern is computed and added in one batch.
+# Positions and steps are tuples (x, y, z), placements and steps of rotation are tuples (x, y, z, pitch, yaw, roll).
+#
+# Following the conventions of Liftoff, an instance with yaw a faces the direction (sin(a), 0, cos(a))
+# and positive pitch tilts its forward direction downwards.
+
+# instances along a line, each one moved and rotated by step from the previous one
+def linear(count, origin, step):
+    steps = np.arange(count, dtype=float)[:, None]
+    return np.asarray(origin, dtype=float) + steps*np.asarray(step, dtype=float)
+
+# instances on a grid, rows along row_step and columns along column_step, all with the rotation of origin
+def grid(rows, columns, origin, row_step, column_step):
+    row, column = np.meshgrid(np.arange(rows, dtype=float), np.arange(columns, dtype=float), indexing="ij")
+    offsets = row.reshape(-1, 1)*np.asarray(row_step, dtype=float) + column.reshape(-1, 1)*np.asarray(column_step, dtype=float)
+    placements = np.tile(np.asarray(origin, dtype=float), (rows*columns, 1))
+    placements[:, :3] += offsets
+    return placements
+
+# instances on a horizontal arc around center
+# @param start_angle = angle of the first instance, 0 is the direction of positive Z
+# @param sweep = angle covered by the arc, a full turn does not repeat the first instance at the end
+# @param yaw_offset = yaw of each instance relative to the direction from the center, 0 faces outwards,
+#                     180 faces the center and 90 follows the arc
+def radial(count, center, radius, start_angle=0, sweep=360, yaw_offset=0, pitch=0, roll=0):
+    divisions = count if sweep % 360 == 0 or count < 2 else count - 1
+    angles = start_angle + sweep*np.arange(count, dtype=float)/divisions
+    radians = np.radians(angles)
+    placements = np.zeros((count, 6))
+    placements[:, :3] = center
+    placements[:, 0] += radius*np.sin(radians)
+    placements[:, 2] += radius*np.cos(radians)
+    placements[:, 3] = pitch
+    placements[:, 4] = (angles + yaw_offset) % 360
+    placements[:, 5] = roll
+    return placements
+
+
+
+# uniform Catmull-Rom spline through all the points
+# @return (positions, tangents) at the parameters t in [0, 1], arrays of shape (M, 3)
+def _catmull_rom(points, t, closed):
+    if closed:
+        points = np.concatenate((points[-1:], points, points[:2]))
+    else:
+        points = np.concatenate((points[:1], points, points[-1:]))
+    segments = len(points) - 3
+    position = np.clip(t*segments, 0, segments - 1e-9)
+    index = position.astype(int)
+    u = (position - index)[:, None]
+    p0, p1, p2, p3 = points[index], points[index+1], points[index+2], points[index+3]
+    positions = 0.5*(2*p1 + (p2 - p0)*u + (2*p0 - 5*p1 + 4*p2 - p3)*u**2 + (3*p1 - p0 - 3*p2 + p3)*u**3)
+    tangents = 0.5*((p2 - p0) + 2*(2*p0 - 5*p1 + 4*p2 - p3)*u + 3*(3*p1 - p0 - 3*p2 + p3)*u**2)
+    return positions, tangents
+
+# Bezier curve having the points as control points, it passes through the first and the last one only
+def _bezier(points, t):
+    degree = len(points) - 1
+    binomials = np.array([1.0]*(degree + 1))
+    for i in range(1, degree + 1):
+        binomials[i] = binomials[i-1]*(degree - i + 1)/i
+    t = t[:, None]
+    i = np.arange(degree + 1)
+    bernstein = binomials*t**i*(1 - t)**(degree - i)
+    positions = bernstein @ points
+    if degree == 0:
+        return positions, np.zeros_like(positions)
+    # the derivative is a Bezier curve of degree - 1 over the differences of the control points
+    i = np.arange(degree)
+    binomials = np.array([1.0]*degree)
+    for j in range(1, degree):
+        binomials[j] = binomials[j-1]*(degree - j)/j
+    bernstein = binomials*t**i*(1 - t)**(degree - 1 - i)
+    tangents = degree*(bernstein @ (points[1:] - points[:-1]))
+    return positions, tangents
+
+# rotations whose forward direction follows the tangents, without roll
+# @return array of shape (M, 3) with pitch, yaw and roll along the GLOBAL axis, as used by the placements
+def _align(tangents, yaw_offset):
+    horizontal = np.hypot(tangents[:, 0], tangents[:, 2])
+    yaw = np.degrees(np.arctan2(tangents[:, 0], tangents[:, 2])) + yaw_offset
+    pitch = np.degrees(np.arctan2(-tangents[:, 1], horizontal))
+    # yaw first and then pitch along the LOCAL axis, converted to the rotation along the GLOBAL axis
+    local = np.stack((pitch, yaw, np.zeros_like(yaw)), axis=-1)
+    return quat_to_global_euler_array(local_euler_to_quat_array(local))
+
+# instances evenly spaced along a curve through the given points
+# @param points = array of shape (P, 3)
+# @param curve = "catmull-rom" passes through every point, "bezier" uses them as control points
+# @param closed = for catmull-rom, join the last point back to the first one
+# @param align = turn each instance so that its forward direction follows the curve, otherwise keep rotation
+# @param rotation = (pitch, yaw, roll) of each instance when not aligned
+def path(count, points, curve="catmull-rom", closed=False, align=True, yaw_offset=0, rotation=(0, 0, 0)):
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    if curve == "catmull-rom":
+        if len(points) < 2:
+            raise ValueError("a Catmull-Rom path needs at least two points")
+        evaluate = lambda t: _catmull_rom(points, t, closed)
+    elif curve == "bezier":
+        if len(points) < 2:
+            raise ValueError("a Bezier path needs at least two points")
+        evaluate = lambda t: _bezier(points, t)
+    else:
+        raise ValueError("unknown curve '{}'".format(curve))
+
+    # the curve is sampled densely to measure its length, then the instances are placed at equal distances
+    samples = np.linspace(0, 1, max(16*count, 256))
+    sample_positions, _ = evaluate(samples)
+    lengths = np.concatenate(([0], np.cumsum(np.linalg.norm(np.diff(sample_positions, axis=0), axis=1))))
+    if closed and curve == "catmull-rom":
+        # the last instance would fall on the first one
+        distances = np.arange(count)*lengths[-1]/count
+    else:
+        distances = np.linspace(0, lengths[-1], count)
+    positions, tangents = evaluate(np.interp(distances, lengths, samples))
+
+    placements = np.zeros((count, 6))
+    placements[:, :3] = positions
+    if align:
+        placements[:, 3:] = _align(tangents, yaw_offset)
+    else:
+        placements[:, 3:] = rotation
+    return placements
@@ -0,0 +1,90 @@
+import os
+from collections import OrderedDict
+from PIL import Image
+
+
+
+# thumbnails resized for the canvas are also saved in this subfolder of the blueprints folder
+THUMBNAIL_DIRECTORY = os.path.join(".cache", "thumbnails")
+
+# number of thumbnails kept in memory
+THUMBNAIL_CAPACITY = 32
+
+
+
+# previews of the blueprints, opened only when first shown
+# the images resized for a given size are kept in a least recently used cache
+# and, if persist is set, saved on disk so that the next session does not resize them again
+class PreviewCache:
+    def __init__(self, directory, capacity=THUMBNAIL_CAPACITY, persist=True):
+        self.directory = directory
+        self.capacity = capacity
+        self.persist = persist
+        self._thumbnails = OrderedDict()
+
+    def _path(self, name):
+        return os.path.join(self.directory, "{}.png".format(name))
+
+    def _thumbnail_path(self, name, width, height):
+        return os.path.join(self.directory, THUMBNAIL_DIRECTORY, "{}_{}x{}.png".format(name, width, height))
+
+    # whether a blueprint has a preview image
+    def __contains__(self, name):
+        return os.path.isfile(self._path(name))
+
+    # the full size preview of a blueprint
+    # @raise OSError if the blueprint has no preview
+    def __getitem__(self, name):
+        with Image.open(self._path(name)) as image:
+            image.load()
+            return image
+
+    # the preview of a blueprint resized to the given size
+    # @raise OSError if the blueprint has no preview
+    def thumbnail(self, name, width, height):
+        key = (name, width, height)
+        if key in self._thumbnails:
+            self._thumbnails.move_to_end(key)
+            return self._thumbnails[key]
+
+        image = self._read_thumbnail(name, width, height)
+        if image is None:
+            image = self[name].resize((width, height), Image.LANCZOS)
+            self._write_thumbnail(name, width, height, image)
+
+        self._thumbnails[key] = image
+        if len(self._thumbnails) > self.capacity:
+            self._thumbnails.popitem(last=False)
+        return image
+
+    # a thumbnail saved on disk is valid if it is newer than the preview it comes from
+    def _read_thumbnail(self, name, width, height):
+        if not self.persist:
+            return None
+        path = self._thumbnail_path(name, width, height)
+        try:
+            if os.path.getmtime(path) < os.path.getmtime(self._path(name)):
+                return None
+            with Image.open(path) as image:
+                image.load()
+                return image
+        except OSError:
+            return None
+
+    def _write_thumbnail(self, name, width, height, image):
+        if not self.persist:
+            return
+        path = self._thumbnail_path(name, width, height)
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            image.save(temporary, format="PNG")
+            os.replace(temporary, path)
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+    def clear(self):
+        self._thumbnails.clear()
@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak memory is not reported there
+    resource = None
+
+
+
+'''
+Timings of the slow operations of the program: loading the blueprints, loading a project and generating the track.
+
+Each operation is divided in phases (parse, instantiate, rotate, serialize, write, ...). The time of a phase does not
+include the phases nested inside it, so the phases of an operation add up to its whole time. At the end of an operation
+its report is handed to the sinks:
+
+log                a line on the standard error
+json=<file>        a JSON object per line appended to the file
+cprofile=<folder>  a cProfile dump of the operation, one file each time, to be read with pstats or snakeviz
+
+Sinks are chosen by the environment variable ELE_PROFILE or by the --profile option of the command line tools,
+separated by commas, for example ELE_PROFILE=log,json=timings.jsonl
+When no sink is set operations and phases do nothing, and cost a function call each.
+
+Each thread measures its own operations, so an operation running in the background of the GUI and one started by the
+window at the same time are reported apart.
+
+Memory is measured for the whole process: each report gives how much the resident memory and its peak grew during the
+operation, which belongs to the operation unless another thread was busy too, and the peak of the process so far.
+'''
+
+ENVIRONMENT_VARIABLE = "ELE_PROFILE"
+
+
+
+class LogSink:
+    def __init__(self, file=None):
+        self.file = file
+
+    def start(self, name):
+        pass
+
+    def finish(self, report):
+        phases = ", ".join("{} {:.3f} s".format(phase, seconds) for phase, seconds in report["phases"].items())
+        counts = ", ".join("{} {}".format(key, value) for key, value in report["counts"].items())
+        line = "[profile] {} {:.3f} s ({})".format(report["operation"], report["seconds"], phases)
+        if counts:
+            line += " {}".format(counts)
+        if report["rss_growth"] is not None:
+            line += " memory {:+.1f} MB".format(report["rss_growth"] / 2**20)
+        if report["process_peak_rss"] is not None:
+            line += " process peak {:.1f} MB (+{:.1f} MB)".format(report["process_peak_rss"] / 2**20,
+                                                                 report["peak_rss_growth"] / 2**20)
+        print(line, file=self.file or sys.stderr)
+
+class JsonSink:
+    def __init__(self, path):
+        self.path = path
+
+    def start(self, name):
+        pass
+
+    def finish(self, report):
+        with open(self.path, "a") as file:
+            file.write(json.dumps(report) + "\n")
+
+class CProfileSink:
+    def __init__(self, directory):
+        self.directory = directory
+        # a profile only sees the thread which enabled it, so each thread has its own
+        self._local = threading.local()
+
+    def start(self, name):
+        self._local.profile = cProfile.Profile()
+        self._local.profile.enable()
+
+    def finish(self, report):
+        profile = self._local.profile
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "{}-{}-{}-{}.prof".format(report["operation"], time.strftime("%Y%m%d-%H%M%S"), os.getpid(), threading.get_ident()))
+        profile.dump_stats(path)
+        self._local.profile = None
+
+SINKS = { "log": LogSink, "json": JsonSink, "cprofile": CProfileSink }
+
+# sinks receiving the reports, none when profiling is disabled
+_sinks = list()
+# operation being measured by each thread, as its attribute operation
+_local = threading.local()
+
+
+
+# @param spec = names of the sinks separated by commas, with their argument after '=' (see above)
+# @raise ValueError if a sink does not exist or lacks its argument
+def configure(spec):
+    sinks = list()
+    for entry in (spec or "").split(","):
+        entry = entry.strip()
+        if entry == "":
+            continue
+        name, _, argument = entry.partition("=")
+        if name not in SINKS:
+            raise ValueError("unknown profiling sink '{}', use {}".format(name, ", ".join(sorted(SINKS))))
+        if name != "log" and argument == "":
+            raise ValueError("profiling sink '{}' needs a path, as in {}=<path>".format(name, name))
+        sinks.append(SINKS[name](argument) if argument else SINKS[name]())
+    _sinks[:] = sinks
+
+def enabled():
+    return bool(_sinks)
+
+# peak resident memory of this process in bytes, None where it cannot be measured
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak*1024
+
+# resident memory of this process in bytes, None where it cannot be measured
+def current_rss():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# difference of two measures, None if either is missing
+def _growth(before, after):
+    return None if before is None or after is None else after - before
+
+# context manager doing nothing, returned when profiling is disabled
+class _Null:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL = _Null()
+
+class _Operation:
+    def __init__(self, name):
+        self.name = name
+        self.phases = dict()
+        self.counts = dict()
+        # phases being measured, innermost last, as [name, time when it was last resumed]
+        self._stack = list()
+
+    def _switch(self, now):
+        if self._stack:
+            phase, since = self._stack[-1]
+            self.phases[phase] = self.phases.get(phase, 0.0) + now - since
+
+    def push(self, phase):
+        now = time.perf_counter()
+        self._switch(now)
+        self._stack.append([phase, now])
+
+    def pop(self):
+        now = time.perf_counter()
+        self._switch(now)
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def __enter__(self):
+        _local.operation = self
+        for sink in _sinks:
+            sink.start(self.name)
+        self._rss = current_rss()
+        self._peak_rss = peak_rss()
+        self._start = time.perf_counter()
+        # time outside any phase is counted as the operation itself
+        self.push(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.pop()
+        seconds = time.perf_counter() - self._start
+        _local.operation = None
+        process_peak_rss = peak_rss()
+        report = { "operation": self.name,
+                   "seconds": round(seconds, 6),
+                   "phases": { phase: round(value, 6) for phase, value in self.phases.items() },
+                   "counts": self.counts,
+                   "rss_growth": _growth(self._rss, current_rss()),
+                   "peak_rss_growth": _growth(self._peak_rss, process_peak_rss),
+                   "process_peak_rss": process_peak_rss }
+        for sink in _sinks:
+            sink.finish(report)
+        return False
+
+class _Phase:
+    def __init__(self, operation, name):
+        self.operation = operation
+        self.name = name
+
+    def __enter__(self):
+        self.operation.push(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.operation.pop()
+        return False
+
+# operation being measured by this thread, or None
+def _current():
+    return getattr(_local, "operation", None)
+
+# measure an operation, reported to the sinks when it ends
+# an operation started inside another one of the same thread is measured as one of its phases
+def operation(name):
+    if not _sinks:
+        return _NULL
+    current = _current()
+    if current is not None:
+        return _Phase(current, name)
+    return _Operation(name)
+
+# measure a phase of the current operation
+def phase(name):
+    current = _current()
+    if current is None:
+        return _NULL
+    return _Phase(current, name)
+
+# add to a count of the current operation, such as the number of items
+def count(name, value):
+    current = _current()
+    if current is not None:
+        current.counts[name] = current.counts.get(name, 0) + value
+
+try:
+    configure(os.environ.get(ENVIRONMENT_VARIABLE))
+except ValueError as e:
+    print("{}: {}".format(ENVIRONMENT_VARIABLE, e), file=sys.stderr)
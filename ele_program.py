@@ -1,111 +1,621 @@
+import gc
 import os
-import xml.etree.ElementTree as ET
-from PIL import Image
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import ele_loader
+import ele_preview
+import ele_project
+import ele_patterns
+import ele_spatial
+import ele_track
+import ele_history
+import ele_ids
+import ele_profile
+
+# number of items written to the track file at once by generate_xml
+XML_CHUNK_SIZE = 1024
+
+# below this number of instances a project is materialized in this process, starting a pool would take longer
+PARALLEL_MIN_INSTANCES = 20000
+
+# long operations report their progress every this many instances, see Cancelled
+PROGRESS_STEP = 4096
+
+# items with the same item ID whose positions match within this distance and whose rotations match within this angle
+# are written only once by generate_xml, when duplicates are removed
+DEDUP_TOLERANCE = 1e-3
+DEDUP_ROTATION_TOLERANCE = 1e-2
+
+# the XML code of the instances is kept between exports up to this many items, about 400 bytes each
+CACHE_XML_MAX_ITEMS = 100000
+
+# Long operations (init, add_instances, load_project, generate_xml) take an optional progress callback,
+# called from time to time as progress(done, total). The callback may raise Cancelled to stop the operation,
+# which then leaves the program as it was before.
+class Cancelled(Exception):
+    pass
+
+# positions of the instances of each blueprint
+# @return dictionary mapping each name to an array of indices, in order of first appearance
+def _group(names):
+    groups = dict()
+    for k, name in enumerate(names):
+        groups.setdefault(name, list()).append(k)
+    return { name: np.array(indices) for name, indices in groups.items() }
+
+# blueprints of this worker process, set by _init_worker
+_blueprints = None
+
+def _init_worker(blueprints):
+    global _blueprints
+    _blueprints = blueprints
+
+# transform a contiguous part of a project, this runs inside the worker processes
+# @return list of (name, indices within the part, arrays returned by Blueprint.transform_many)
+def _transform_shard(names, placements, counters):
+    return [(name, indices, _blueprints[name].transform_many(placements[indices], counters[indices]))
+            for name, indices in _group(names).items()]
+
+# find the items to write when duplicates are removed, all the instances at once
+# an item is a duplicate when it has the same item ID as an item kept before it, lies within tolerance from it and
+# its orientation differs by at most rotation_tolerance degrees; candidates are found with ele_spatial.close_pairs,
+# which also looks into the neighbouring cells, so items near the border of a cell are compared as well
+# @return list with, for each instance, a boolean array telling which items are written, or None if all of them are
+# @raise ValueError if tolerance is not positive or rotation_tolerance is negative
+def _first_occurrences(instances, tolerance, rotation_tolerance):
+    if tolerance <= 0:
+        raise ValueError("the tolerance of duplicates must be positive, not {}".format(tolerance))
+    if rotation_tolerance < 0:
+        raise ValueError("the rotation tolerance of duplicates must not be negative, not {}".format(rotation_tolerance))
+    sizes = np.array([len(instance.items) for instance in instances], dtype=np.int64)
+    if not int(sizes.sum()):
+        return [None]*len(instances)
+    item_codes = dict()
+    codes = np.array([item_codes.setdefault(item_id, len(item_codes)) for instance in instances for item_id in instance.items.item_ids], dtype=np.int64)
+    positions = np.concatenate([instance.items.positions for instance in instances])
+    quats = np.concatenate([instance.items.quats for instance in instances])
+
+    first, second = ele_spatial.close_pairs(positions, tolerance, codes)
+    # the angle between two orientations is 2*acos(|q1.q2|), q and -q being the same orientation
+    keep = np.abs(np.einsum("ij,ij->i", quats[first], quats[second])) >= np.cos(np.radians(rotation_tolerance)/2)
+    earlier = np.minimum(first[keep], second[keep])
+    later = np.maximum(first[keep], second[keep])
+
+    # items are visited in the order they are written, an item is dropped only if the earlier one is kept,
+    # which needs a visit only when some earlier item is a duplicate itself
+    dropped = np.zeros(len(positions), dtype=bool)
+    if np.isin(earlier, later).any():
+        order = np.lexsort((earlier, later))
+        dropped_rows = set()
+        for a, b in zip(earlier[order].tolist(), later[order].tolist()):
+            if a not in dropped_rows:
+                dropped_rows.add(b)
+        dropped[list(dropped_rows)] = True
+    else:
+        dropped[later] = True
+    bounds = np.cumsum(sizes).tolist()
+    return [None if not dropped[end - size:end].any() else ~dropped[end - size:end]
+            for end, size in zip(bounds, sizes.tolist())]
+
 
-import ele_utils
 
 class Program:
     def __init__(self):
         self.blueprints = dict()
-        self.previews = dict()
-        self.instances = list()
-        self.instance_id_counter = 0
-
-    def init(self):
-        for xml_file in os.listdir("./blueprints"):
-            if xml_file.endswith(".xml"):
-                name = xml_file[:-4]
-                blueprint = ele_utils.Blueprint(name)
-                self.blueprints[name] = blueprint
-                
-                '''
-                Structure of the XML model (note the XSD declaration in the root tag, not present in Liftoff files but required here for parsing)
-                
-                <blueprints xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
-                  <TrackBlueprint xsi:type="TrackBlueprintFlag">
-                    <itemID>...</itemID>
-                    <instanceID>...</instanceID>
-                    <position>
-                      <x>...</x>
-                      <y>...</y>
-                      <z>...</z>
-                    </position>
-                    <rotation>
-                      <x>...</x>
-                      <y>...</y>
-                      <z>...</z>
-                    </rotation>
-                    <purpose>Functional</purpose>
-                  </TrackBlueprint>
-                </blueprints>
-                '''
-                
-                root = ET.parse("./blueprints/{}".format(xml_file)).getroot()
-                for TrackBlueprint in root:
-                    itemID = TrackBlueprint[0].text
-                    instanceID = TrackBlueprint[1].text
-
-                    pos_x = float(TrackBlueprint[2][0].text)
-                    pos_y = float(TrackBlueprint[2][1].text)
-                    pos_z = float(TrackBlueprint[2][2].text)
-
-                    rot_x = float(TrackBlueprint[3][0].text)
-                    rot_y = float(TrackBlueprint[3][1].text)
-                    rot_z = float(TrackBlueprint[3][2].text)
-                    
-                    this_item = ele_utils.Item(itemID, instanceID, pos_x, pos_y, pos_z, rot_x, rot_y, rot_z)
-                    blueprint.add(this_item)
-                
-                # load blueprint preview if existing
-                try:
-                    image = Image.open("./blueprints/{}.png".format(name))
-                    self.previews[name] = image
-                except:
-                    pass
+        # previews are opened lazily, when a blueprint is selected
+        self.previews = ele_preview.PreviewCache(ele_loader.BLUEPRINTS_DIRECTORY)
+        # instances are also known by a handle, which does not change when other instances are removed
+        self.instances = ele_history.InstanceStore()
+        # gives each instance a block of instance IDs, see instance_id_counter
+        self.ids = ele_ids.IdAllocator()
+        # changes to the instances which can be undone, see undo and redo
+        self.history = ele_history.History()
+        # records the changes to the instances when open, see open_journal
+        self.journal = None
+        # (file name, number of items, seconds, read from cache, error) for each blueprint loaded by init
+        # the error is None unless the blueprint could not be loaded and was skipped, see ele_loader.load_library
+        self.load_report = list()
+        # keep the XML code of each instance between exports while the project has at most this many items, 0 never
+        # keeps it, see iter_items
+        self.cache_xml = CACHE_XML_MAX_ITEMS
+        # remove duplicate items when exporting, see iter_xml
+        self.deduplicate = False
+        self.dedup_tolerance = DEDUP_TOLERANCE
+        self.dedup_rotation_tolerance = DEDUP_ROTATION_TOLERANCE
+        # number of items removed by the last export
+        self.removed_duplicates = 0
+        # radius of the space occupied by each item ID, see ele_spatial
+        self.item_radii = dict()
+        # built by the first spatial query and then kept up to date as instances are added and removed
+        self._spatial_index = None
+
+    # highest instance ID in use, written as lastTrackItemID
+    # setting it tells that the IDs up to the value are already used by the track, see reserve_instance_ids
+    @property
+    def instance_id_counter(self):
+        return self.ids.last
+
+    @instance_id_counter.setter
+    def instance_id_counter(self, value):
+        self.reserve_instance_ids(value)
+
+    # keep the IDs up to value for the items already in the track, the instances are numbered after them
+    # instances using some of these IDs are numbered again, see compact_instance_ids
+    def reserve_instance_ids(self, value):
+        if len(self.instances) == 0:
+            # with no instance left the numbering starts over
+            self.ids.floor = value
+            self.ids.clear()
+        else:
+            self.ids.reserve(value)
+        if self.journal is not None:
+            self.journal.write({ "op": "reserve", "value": value })
+        first_id = self._first_instance_id()
+        if first_id is not None and first_id <= value:
+            self.compact_instance_ids()
+
+    # lowest instance ID of the project, or None without items
+    def _first_instance_id(self):
+        return min((int(instance.items.instance_ids[0]) for instance in self.instances if len(instance.items)), default=None)
+
+    # number the items again from the reserved IDs onwards, in the order of the instances and without gaps,
+    # for example before exporting a project where many instances were removed
+    # IDs are compared all at once and only the instances whose IDs change are touched, so they keep their XML code
+    # @return number of IDs saved, which were left free by removed instances
+    def compact_instance_ids(self):
+        instances = list(self.instances)
+        sizes = np.array([len(instance.items) for instance in instances], dtype=np.int64)
+        saved = self.ids.last - self.ids.floor - int(sizes.sum())
+        self.ids.clear()
+        starts = self.ids.allocate_many(sizes)
+        if int(sizes.sum()):
+            current = np.concatenate([instance.items.instance_ids for instance in instances])
+            wanted = np.arange(self.ids.floor + 1, self.ids.next)
+            # instance owning each item whose ID changes
+            changed = np.unique(np.searchsorted(np.cumsum(sizes), np.flatnonzero(current != wanted), side="right"))
+            for k in changed.tolist():
+                instances[k].sync_instance_id(int(starts[k]) - 1)
+        if self.journal is not None:
+            self.journal.write({ "op": "compact" })
+        return saved
+
+    # give back the IDs of instances taken out of the project
+    def _free_ids(self, instances):
+        for instance in instances:
+            if len(instance.items):
+                self.ids.free(int(instance.items.instance_ids[0]), len(instance.items))
+
+    # take again the IDs of instances put back, or new ones if they were given to others in the meantime
+    def _take_ids(self, instances):
+        for instance in instances:
+            size = len(instance.items)
+            if size and not self.ids.take(int(instance.items.instance_ids[0]), size):
+                instance.sync_instance_id(self.ids.allocate(size) - 1)
+
+    def init(self, directory=ele_loader.BLUEPRINTS_DIRECTORY, workers=None, use_cache=True, progress=None):
+        with ele_profile.operation("init"):
+            blueprints, self.load_report = ele_loader.load_library(directory, workers, use_cache, progress)
+        self.blueprints.update(blueprints)
+        self.previews = ele_preview.PreviewCache(directory)
         return tuple(self.blueprints.keys())
 
+    # define a composite blueprint made of other blueprints, placed around its center
+    # it only lasts for this session: to keep it, save the same placements as a project in the blueprints folder
+    # @param names = name of the blueprint of each child
+    # @param placements = array of shape (K, 6) with x, y, z, pitch, yaw, roll of each child
+    # @return the new blueprint
+    # @raise KeyError if a child does not exist
+    def compose_blueprint(self, name, names, placements):
+        blueprint = ele_loader.make_blueprint(name, ele_loader.flatten(names, placements, self.blueprints))
+        self.blueprints[name] = blueprint
+        return blueprint
+
+    # register the items of a Liftoff track as blueprints, see ele_track
+    # like compose_blueprint they only last for this session, ele_track.py writes them into the blueprints folder
+    # @param name = name of the blueprint, or prefix of the pieces, by default the name of the file
+    # @param split = split the track into a blueprint for each piece, see ele_track.split_track
+    # @return (names, placements) of the new blueprints where they are in the track, for add_instances
+    def import_track(self, path, name=None, split=False, distance=ele_track.SPLIT_DISTANCE, same_item_id=False):
+        name = name or ele_track.default_name(path)
+        with ele_profile.operation("import_track"):
+            if split:
+                blueprints, placements = ele_track.split_track(path, name, distance, same_item_id)
+            else:
+                blueprints, placements = [ele_track.import_track(path, name)], np.zeros((1, 6))
+            ele_profile.count("items", sum(len(blueprint.items) for blueprint in blueprints))
+        for blueprint in blueprints:
+            self.blueprints[blueprint.name] = blueprint
+        return [blueprint.name for blueprint in blueprints], placements
+
     def add_instance(self, name, x, y, z, pitch, yaw, roll):
-        new_instance = self.blueprints[name].copy()
-        self.instance_id_counter = new_instance.sync_instance_id(self.instance_id_counter)
+        new_instance = self.blueprints[name].instantiate(x, y, z, pitch, yaw, roll)
+        new_instance.sync_instance_id(self.ids.allocate(len(new_instance.items)) - 1)
         
-        new_instance.translate(x, y, z)
-        new_instance.rotate(pitch, yaw, roll)
-        
-        self.instances.append(new_instance)
+        handle = self.instances.append(new_instance)
+        if self._spatial_index is not None:
+            self._spatial_index.add(new_instance)
+        self.history.record(ele_history.Change(ele_history.ADD, (handle,), (new_instance,)))
+        if self.journal is not None:
+            self.journal.write({ "op": "add", "names": [name], "placements": [[x, y, z, pitch, yaw, roll]] })
         
         return new_instance.pretty_print()
 
+    # @param index = position of the instance among the ones present
     def remove_instance(self, index):
-        del self.instances[index]
-
-    def load_project(self, file):
-        with open(file, "r") as file:
-            data = file.read().split('\n')
-                
-        self.instances = list()
-        for instance in data:
-            values = instance.split(':')
-            name = values[0]
-            x, y, z, pitch, yaw, roll = map(lambda x: float(x), values[1:])
-                    
-            new_instance = self.blueprints[name].copy()
-            self.instance_id_counter = new_instance.sync_instance_id(self.instance_id_counter)
-                
-            new_instance.translate(x, y, z)
-            new_instance.rotate(pitch, yaw, roll)
-            
-            self.instances.append(new_instance)
+        self.remove_instances((self.instances.handle(index),))
+
+    # remove instances by their handle, see ele_history.InstanceStore
+    # a handle given more than once removes its instance once
+    # @raise KeyError if an instance is not present, in which case none is removed
+    def remove_instances(self, handles):
+        handles = list(dict.fromkeys(handles))
+        for handle in handles:
+            self.instances.get(handle)
+        instances = [self.instances.remove(handle) for handle in handles]
+        self._free_ids(instances)
+        if self._spatial_index is not None:
+            self._spatial_index.remove_many(instances)
+        self.history.record(ele_history.Change(ele_history.REMOVE, handles, instances))
+        if self.journal is not None:
+            self.journal.write({ "op": "remove", "handles": handles })
+
+    # add or remove the instances of a change, without recomputing anything
+    def _apply(self, change):
+        if change.kind == ele_history.UPDATE:
+            for instance, state in zip(change.instances, change.states[1]):
+                instance.place(*state)
+            if self._spatial_index is not None:
+                self._spatial_index.remove_many(change.instances)
+                self._spatial_index.extend(change.instances)
+        elif change.kind == ele_history.ADD:
+            for handle, instance in zip(change.handles, change.instances):
+                self.instances.restore(handle, instance)
+            self._take_ids(change.instances)
+            if self._spatial_index is not None:
+                self._spatial_index.extend(change.instances)
+        else:
+            for handle in change.handles:
+                self.instances.remove(handle)
+            self._free_ids(change.instances)
+            if self._spatial_index is not None:
+                self._spatial_index.remove_many(change.instances)
+
+    # move an instance to a new placement, as if it had been added there
+    # @param index = position of the instance among the ones present
+    def update_instance(self, index, x, y, z, pitch, yaw, roll):
+        self.update_instances((self.instances.handle(index),), ((x, y, z, pitch, yaw, roll),))
+
+    # move instances by their handle
+    # only the items of these instances are computed again, from the offsets and quaternions cached by their blueprint,
+    # and they keep their instance IDs
+    # @param placements = array of shape (K, 6) with the new x, y, z, pitch, yaw, roll of each instance
+    # @raise KeyError if an instance is not present or its blueprint does not exist, in which case none is moved
+    # @raise ValueError if a blueprint changed its number of items since its instances were added, same as above
+    def update_instances(self, handles, placements):
+        handles = list(handles)
+        placements = np.asarray(placements, dtype=float).reshape(-1, 6)
+        instances = [self.instances.get(handle) for handle in handles]
+        groups = _group([instance.name for instance in instances])
+        arrays = { name: self.blueprints[name].transform_many(placements[indices]) for name, indices in groups.items() }
+        for name, indices in groups.items():
+            for k in indices.tolist():
+                if len(instances[k].items) != arrays[name][3].shape[1]:
+                    raise ValueError("blueprint {} changed since its instances were added".format(name))
+
+        before = [instance.state() for instance in instances]
+        for name, indices in groups.items():
+            centers, angles, _, positions, rotations, quats = arrays[name]
+            for k, center, angle, position, rotation, quat in zip(indices.tolist(), centers.tolist(), angles.tolist(), positions, rotations, quats):
+                instances[k].place(center, angle, position, rotation, quat)
+        after = [instance.state() for instance in instances]
+        if self._spatial_index is not None:
+            self._spatial_index.remove_many(instances)
+            self._spatial_index.extend(instances)
+
+        self.history.record(ele_history.Change(ele_history.UPDATE, handles, instances, states=(before, after)))
+        if self.journal is not None:
+            self.journal.write({ "op": "update", "handles": handles, "placements": placements.tolist() })
+
+    # undo the last change to the instances
+    # @return the change applied to undo it, see ele_history.Change, or None if there is nothing to undo
+    def undo(self):
+        change = self.history.undo()
+        if change is not None:
+            self._apply(change)
+            if self.journal is not None:
+                self.journal.write({ "op": "undo" })
+        return change
+
+    # do again the last change undone
+    # @return the change applied, or None if there is nothing to redo
+    def redo(self):
+        change = self.history.redo()
+        if change is not None:
+            self._apply(change)
+            if self.journal is not None:
+                self.journal.write({ "op": "redo" })
+        return change
+
+    # record every following change to the instances at the end of a file, see ele_history
+    def open_journal(self, path):
+        self.close_journal()
+        self.journal = ele_history.Journal(path)
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    # do again the changes recorded in a journal, for example after a crash
+    # the blueprints and the project files named in the journal must still be there
+    # @return number of changes replayed
+    def replay_journal(self, path):
+        journal, self.journal = self.journal, None
+        try:
+            records = ele_history.read_journal(path)
+            for record in records:
+                if record["op"] == "load":
+                    self.load_project(record["project"])
+                elif record["op"] == "add":
+                    self.add_instances(record["names"], record["placements"])
+                elif record["op"] == "remove":
+                    self.remove_instances(record["handles"])
+                elif record["op"] == "update":
+                    self.update_instances(record["handles"], record["placements"])
+                elif record["op"] == "reserve":
+                    self.reserve_instance_ids(record["value"])
+                elif record["op"] == "compact":
+                    self.compact_instance_ids()
+                elif record["op"] == "undo":
+                    self.undo()
+                elif record["op"] == "redo":
+                    self.redo()
+        finally:
+            self.journal = journal
+        return len(records)
+
+    # add many instances at once, numbered in the given order, see ele_ids
+    # instances of the same blueprint are transformed together in a single batch
+    # @param names = name of the blueprint of each instance
+    # @param placements = array of shape (K, 6) with x, y, z, pitch, yaw, roll of each instance
+    # @param workers = number of processes transforming the instances, 1 transforms them in this process
+    #                  None uses a pool with one process per core for large projects
+    #                  the project is split in contiguous parts, so instances and IDs are the same in any case
+    # @param progress = callback receiving the number of instances transformed, see Cancelled
+    # @return the new instances
+    # @raise KeyError if a blueprint does not exist, in which case no instance is added
+    def add_instances(self, names, placements, workers=1, progress=None):
+        names = list(names)
+        placements = np.asarray(placements, dtype=float).reshape(-1, 6)
+        with ele_profile.operation("add_instances"):
+            handles, new_instances = self._add_instances(names, placements, workers, progress)
+        self.history.record(ele_history.Change(ele_history.ADD, handles, new_instances))
+        if self.journal is not None:
+            self.journal.write({ "op": "add", "names": names, "placements": placements.tolist() })
+        return new_instances
+
+    def _add_instances(self, names, placements, workers, progress):
+        names = list(names)
+        placements = np.asarray(placements, dtype=float).reshape(-1, 6)
+        sizes = np.array([len(self.blueprints[name].items) for name in names], dtype=np.int64)
+        # a failed batch gives its IDs back
+        previous_ids = self.ids.copy()
+        counters = self.ids.allocate_many(sizes) - 1
+        if workers is None:
+            workers = 1 if len(names) < PARALLEL_MIN_INSTANCES else os.cpu_count()
+        workers = max(1, min(workers, len(names)))
+
+        new_instances = [None]*len(names)
+        # the new objects hold no reference cycles, collecting garbage while they are created only slows the batch down
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if workers == 1:
+                done = 0
+                for name, indices in _group(names).items():
+                    for begin in range(0, len(indices), PROGRESS_STEP):
+                        part = indices[begin:begin + PROGRESS_STEP]
+                        for k, instance in zip(part.tolist(), self.blueprints[name].instantiate_many(placements[part], counters[part])):
+                            new_instances[k] = instance
+                        done += len(part)
+                        if progress is not None:
+                            progress(done, len(names))
+            else:
+                # workers only receive the blueprints used by the project, and send back plain arrays
+                used = { name: self.blueprints[name] for name in set(names) }
+                bounds = np.linspace(0, len(names), workers + 1).astype(int).tolist()
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(used,)) as executor:
+                    futures = [executor.submit(_transform_shard, names[begin:end], placements[begin:end], counters[begin:end])
+                               for begin, end in zip(bounds[:-1], bounds[1:])]
+                    for begin, end, future in zip(bounds[:-1], bounds[1:], futures):
+                        with ele_profile.phase("rotate"):
+                            shard = future.result()
+                        with ele_profile.phase("instantiate"):
+                            for name, indices, arrays in shard:
+                                for k, instance in zip((begin + indices).tolist(), self.blueprints[name].instances_from_arrays(*arrays)):
+                                    new_instances[k] = instance
+                        if progress is not None:
+                            progress(end, len(names))
+        except BaseException:
+            self.ids = previous_ids
+            raise
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        handles = self.instances.extend(new_instances)
+        ele_profile.count("instances", len(new_instances))
+        ele_profile.count("items", int(sizes.sum()))
+        if self._spatial_index is not None:
+            self._spatial_index.extend(new_instances)
+        return handles, new_instances
+
+    # Patterns of instances of a single blueprint, see ele_patterns for the meaning of the parameters.
+    # All the placements are computed together and the instances are added in one batch.
+    # @return the new instances
+
+    def add_linear_array(self, name, count, origin, step):
+        return self.add_instances([name]*count, ele_patterns.linear(count, origin, step))
+
+    def add_grid(self, name, rows, columns, origin, row_step, column_step):
+        return self.add_instances([name]*(rows*columns), ele_patterns.grid(rows, columns, origin, row_step, column_step))
+
+    def add_radial_array(self, name, count, center, radius, start_angle=0, sweep=360, yaw_offset=0, pitch=0, roll=0):
+        return self.add_instances([name]*count, ele_patterns.radial(count, center, radius, start_angle, sweep, yaw_offset, pitch, roll))
+
+    def add_along_path(self, name, count, points, curve="catmull-rom", closed=False, align=True, yaw_offset=0, rotation=(0, 0, 0)):
+        return self.add_instances([name]*count, ele_patterns.path(count, points, curve, closed, align, yaw_offset, rotation))
+
+    # index of the items of all the instances, built on first use
+    def spatial_index(self):
+        if self._spatial_index is None:
+            self._spatial_index = ele_spatial.SpatialIndex(self.item_radii)
+            self._spatial_index.extend(self.instances)
+        return self._spatial_index
+
+    # items of different instances occupying the same space
+    # @return list of (instance, item, other instance, other item, depth) from the deepest overlap, see SpatialIndex
+    def find_overlaps(self, tolerance=0.0):
+        return self.spatial_index().overlaps(tolerance=tolerance)
+
+    # items placed twice at the same position
+    # @return list of (instance, item, other instance, other item)
+    def find_duplicates(self, tolerance=ele_spatial.DUPLICATE_TOLERANCE):
+        return self.spatial_index().duplicates(tolerance)
+
+    # @return list of (instance, item, distance) of the items within a distance from a point, from the nearest one
+    def items_near(self, x, y, z, distance):
+        return self.spatial_index().near((x, y, z), distance)
+
+    # load a project either in the binary format or as a colon-delimited project.dat
+    # @param workers = number of processes transforming the instances, see add_instances
+    # @param progress = callback receiving the number of instances loaded, see Cancelled
+    def load_project(self, file, workers=1, progress=None):
+        with ele_profile.operation("load_project"):
+            with ele_profile.phase("read"):
+                names, placements = ele_project.read_project(file)
+        
+            previous = (self.instances, self._spatial_index, self.ids)
+            self.instances = ele_history.InstanceStore()
+            self._spatial_index = None
+            # the numbering starts over after the reserved IDs
+            self.ids = ele_ids.IdAllocator(self.ids.floor)
+            try:
+                with ele_profile.operation("add_instances"):
+                    self._add_instances(names, placements, workers, progress)
+            except BaseException:
+                self.instances, self._spatial_index, self.ids = previous
+                raise
             
+        # loading a project cannot be undone
+        self.history.clear()
+        if self.journal is not None:
+            self.journal.write({ "op": "load", "project": os.path.abspath(file) })
         return map(lambda x: x.pretty_print(), self.instances)
         
     def save_project(self, file):
-        output = '\n'.join(map(lambda instance: instance.serialize(), self.instances))
-        file.write(output)
-
-    def generate_xml(self, file):
-        xml_output = '  <blueprints>'
-        for instance in self.instances:
-            xml_output += str(instance)
-        xml_output += '\n  </blueprints>'
-        xml_output += '\n  <lastTrackItemID>{}</lastTrackItemID>'.format(self.instance_id_counter)
-        file.write(xml_output)
+        with ele_profile.operation("save_project"), ele_profile.phase("serialize"):
+            output = '\n'.join(map(lambda instance: instance.serialize(), self.instances))
+            with ele_profile.phase("write"):
+                file.write(output)
+
+    # placement of each instance, as stored in a project
+    # @return (names, placements) with the name of each instance and an array of shape (K, 6)
+    def placements(self):
+        names = [instance.name for instance in self.instances]
+        placements = [(instance.pos_x, instance.pos_y, instance.pos_z, instance.rot_x, instance.rot_y, instance.rot_z)
+                      for instance in self.instances]
+        return names, np.array(placements, dtype=float).reshape(-1, 6)
+
+    # save the project in the binary format, see ele_project
+    def save_binary_project(self, path):
+        ele_project.write_binary(path, *self.placements())
+
+    # XML code of the items of the track, produced piece by piece
+    # while the project has at most cache_xml items each instance keeps the XML code of its items, so exporting again
+    # only formats the instances added or changed since the last export
+    # larger projects keep nothing, and give back what earlier exports kept, so their document is never held in memory
+    # with deduplicate an item equal to one already written is skipped, and removed_duplicates counts them
+    # the duplicates are found before writing, see _first_occurrences
+    # @param progress = callback receiving the number of instances exported, see Cancelled
+    # @raise ValueError with deduplicate if dedup_tolerance is not positive
+    def iter_items(self, progress=None, first_id=None):
+        keeps = None
+        if self.deduplicate:
+            keeps = _first_occurrences(list(self.instances), self.dedup_tolerance, self.dedup_rotation_tolerance)
+        self.removed_duplicates = 0
+        cache = first_id is None and sum(len(instance.items) for instance in self.instances) <= self.cache_xml
+        for done, instance in enumerate(self.instances):
+            if progress is not None and done % PROGRESS_STEP == 0:
+                progress(done, len(self.instances))
+            keep = None if keeps is None else keeps[done]
+            if keep is not None:
+                self.removed_duplicates += len(keep) - int(keep.sum())
+                yield from instance.iter_xml(keep, first_id)
+            elif cache:
+                yield instance.xml()
+            else:
+                instance.drop_xml()
+                yield from instance.iter_xml(None, first_id)
+            if first_id is not None:
+                # removed duplicates keep their IDs, as compact_instance_ids numbers all the items
+                first_id += len(instance.items)
+        if progress is not None:
+            progress(len(self.instances), len(self.instances))
+
+    # XML code of the track, the "blueprints" tag followed by the last instance ID, see iter_items
+    def iter_xml(self, progress=None):
+        yield '  <blueprints>'
+        yield from self.iter_items(progress)
+        yield '\n  </blueprints>'
+        yield '\n  <lastTrackItemID>{}</lastTrackItemID>'.format(self.instance_id_counter)
+
+    # write the XML code of the track into a file
+    # @param chunk_size = number of pieces joined together for each write
+    # @param progress = callback receiving the number of instances exported, see Cancelled
+    #                   a cancelled export leaves the file incomplete
+    # @return number of duplicate items removed
+    def generate_xml(self, file, chunk_size=XML_CHUNK_SIZE, progress=None):
+        with ele_profile.operation("generate_xml"), ele_profile.phase("serialize"):
+            chunk = list()
+            for piece in self.iter_xml(progress):
+                chunk.append(piece)
+                if len(chunk) >= chunk_size:
+                    with ele_profile.phase("write"):
+                        file.write(''.join(chunk))
+                    chunk.clear()
+            with ele_profile.phase("write"):
+                file.write(''.join(chunk))
+            if ele_profile.enabled():
+                ele_profile.count("written items", sum(len(instance.items) for instance in self.instances) - self.removed_duplicates)
+        return self.removed_duplicates
+
+    # write the items into a track file saved by Liftoff, in place of pasting the output of generate_xml into it
+    # the track is streamed through and the result replaces the output file only once complete, see ele_track.merge_track
+    # @param output = file written, by default the track itself
+    # @param append = keep the items already in the track, the project is numbered again after their IDs if needed
+    #                  the new IDs are written straight into the output, and given to the project only once the merge
+    #                  succeeded, so a failed or cancelled merge leaves it as it was
+    # @param progress = callback receiving the number of instances exported, see Cancelled
+    # @return number of duplicate items removed
+    # @raise ValueError if the file is not a track
+    def merge_xml(self, track, output=None, append=False, progress=None):
+        with ele_profile.operation("merge_xml"):
+            first_id = self._first_instance_id()
+            last_id = self.instance_id_counter
+            pieces = self.iter_items(progress)
+            highest = ele_track.highest_instance_id(track) if append else None
+            if highest is not None and first_id is not None and first_id <= highest:
+                # numbered after the items of the track the same way reserve_instance_ids will do it
+                first_id = highest + 1
+                last_id = highest + sum(len(instance.items) for instance in self.instances)
+                pieces = self.iter_items(progress, first_id)
+            elif highest is not None:
+                last_id = max(last_id, highest)
+            ele_track.merge_track(track, pieces, last_id, first_id, output, append)
+            if highest is not None and highest > self.ids.floor:
+                self.reserve_instance_ids(highest)
+            if ele_profile.enabled():
+                ele_profile.count("written items", sum(len(instance.items) for instance in self.instances) - self.removed_duplicates)
+        return self.removed_duplicates
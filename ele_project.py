@@ -0,0 +1,191 @@
+import sys
+import csv
+import json
+import struct
+
+import numpy as np
+
+
+
+'''
+Binary project format (all numbers little endian)
+
+header     magic "ELEPROJ" + NUL, version (uint16), reserved (uint16), number of names (uint32), number of instances (uint32)
+names      for each name: length in bytes (uint16) followed by the name in UTF-8
+padding    zeros up to a multiple of 8 bytes
+instances  for each instance a record of RECORD_DTYPE: index of its name (uint32), 4 bytes of padding,
+           position x, y, z and rotation pitch, yaw, roll (float64)
+
+Records have a fixed size, so the instances are memory-mapped and the i-th one is read without parsing the others.
+'''
+
+MAGIC = b"ELEPROJ\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHII")
+RECORD_DTYPE = np.dtype([("name", "<u4"), ("padding", "<u4"), ("placement", "<f8", (6,))])
+
+# extension of the binary format, any other file is read as a colon-delimited project.dat
+BINARY_EXTENSION = ".elp"
+
+# placement manifests written by other tools, with one field per coordinate
+CSV_EXTENSION = ".csv"
+JSON_EXTENSION = ".json"
+FIELDS = ("x", "y", "z", "pitch", "yaw", "roll")
+
+
+
+# random access reader of a binary project
+class ProjectFile:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            magic, version, _, n_names, n_instances = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a binary project".format(path))
+            if version > VERSION:
+                raise ValueError("{} was written by a newer version (format {})".format(path, version))
+            self.names = list()
+            for _ in range(n_names):
+                length, = struct.unpack("<H", file.read(2))
+                self.names.append(file.read(length).decode("utf-8"))
+            offset = _align(file.tell())
+
+        if n_instances == 0:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+        else:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=offset, shape=(n_instances,))
+
+    def __len__(self):
+        return len(self.records)
+
+    # @return (name, x, y, z, pitch, yaw, roll) of the index-th instance
+    def __getitem__(self, index):
+        record = self.records[index]
+        return (self.names[record["name"]],) + tuple(record["placement"].tolist())
+
+    # @return (names, placements) with the name of each instance and an array of shape (K, 6)
+    def placements(self):
+        names = [self.names[index] for index in self.records["name"].tolist()]
+        return names, np.array(self.records["placement"], dtype=float).reshape(-1, 6)
+
+    def close(self):
+        self.records = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+def is_binary(path):
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+
+# write a binary project
+# @param names = name of the blueprint of each instance
+# @param placements = array of shape (K, 6) with x, y, z, pitch, yaw, roll of each instance
+def write_binary(path, names, placements):
+    table = dict()
+    indices = [table.setdefault(name, len(table)) for name in names]
+
+    records = np.zeros(len(indices), dtype=RECORD_DTYPE)
+    records["name"] = indices
+    records["placement"] = np.asarray(placements, dtype=float).reshape(-1, 6)
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0, len(table), len(indices)))
+        for name in table:
+            encoded = name.encode("utf-8")
+            file.write(struct.pack("<H", len(encoded)))
+            file.write(encoded)
+        file.write(b"\0"*(_align(file.tell()) - file.tell()))
+        file.write(records.tobytes())
+
+# read a text project, where each line is name:x:y:z:p:y:r
+# @raise ValueError if a line has invalid values
+def read_text(path):
+    names = list()
+    values = list()
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if line == "":
+                continue
+            fields = line.split(':')
+            if len(fields) != 7:
+                raise ValueError("invalid line '{}'".format(line))
+            names.append(fields[0])
+            values.append(fields[1:])
+    return names, np.array(values, dtype=float).reshape(-1, 6)
+
+# values are rounded one by one with round, as Blueprint.serialize does
+def write_text(file, names, placements):
+    file.write('\n'.join("{}:{}:{}:{}:{}:{}:{}".format(name, *(round(value, 3) for value in placement))
+                         for name, placement in zip(names, np.asarray(placements, dtype=float).reshape(-1, 6).tolist())))
+
+# placements given as dictionaries with the name of the blueprint and any of the FIELDS, missing ones are zero
+# @raise ValueError if a placement is not a dictionary, the name is missing or a value is not a number
+def _read_records(records):
+    names = list()
+    values = list()
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("instance is not an object: {}".format(record))
+        if not record.get("name") or not isinstance(record["name"], str):
+            raise ValueError("instance without name: {}".format(record))
+        names.append(record["name"])
+        try:
+            values.append([float(record.get(field) or 0) for field in FIELDS])
+        except TypeError:
+            raise ValueError("invalid coordinates: {}".format(record))
+    return names, np.array(values, dtype=float).reshape(-1, 6)
+
+# read a CSV manifest, whose header names the columns: name, x, y, z, pitch, yaw, roll
+def read_csv(path):
+    with open(path, "r", newline="") as file:
+        reader = csv.DictReader(file)
+        if reader.fieldnames is None or "name" not in reader.fieldnames:
+            raise ValueError("{} has no 'name' column".format(path))
+        return _read_records(reader)
+
+# read a JSON manifest, either a list of instances or an object with the list under "instances",
+# where each instance is an object with name, x, y, z, pitch, yaw, roll
+def read_json(path):
+    with open(path, "r") as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        data = data.get("instances", list())
+    if not isinstance(data, list):
+        raise ValueError("{} has no list of instances".format(path))
+    return _read_records(data)
+
+# read a project in any format: binary, CSV, JSON or colon-delimited text
+# @return (names, placements) with the name of each instance and an array of shape (K, 6)
+def read_project(path):
+    if is_binary(path):
+        with ProjectFile(path) as project:
+            return project.placements()
+    if path.lower().endswith(CSV_EXTENSION):
+        return read_csv(path)
+    if path.lower().endswith(JSON_EXTENSION):
+        return read_json(path)
+    return read_text(path)
+
+
+
+# convert a project between the two formats, the output format follows its extension
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python ele_project.py <input project> <output project>")
+        sys.exit(1)
+    names, placements = read_project(sys.argv[1])
+    if sys.argv[2].endswith(BINARY_EXTENSION):
+        write_binary(sys.argv[2], names, placements)
+    else:
+        with open(sys.argv[2], "w") as file:
+            write_text(file, names, placements)
+    print("{} instances converted".format(len(names)))
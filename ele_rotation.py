@@ -0,0 +1,173 @@
+import numpy as np
+from math import radians, degrees, sin, cos, asin, atan2
+
+
+
+# Closed-form conversions between Euler angles and quaternions.
+# Quaternions are tuples or array rows (w, x, y, z), the same order used by pyquaternion.
+# Angles are in degrees, x is pitch, y is yaw and z is roll, the order of rotation is YXZ.
+#
+# Rotating by Y, then by the rotated X, then by the rotated Z (LOCAL axis, as in the Liftoff Editor)
+# is the same as rotating by Z, then X, then Y along the fixed axis, so:
+# - local rotation  = q_y*q_x*q_z
+# - global rotation = q_z*q_x*q_y
+# where q_x, q_y and q_z are the elementary rotations (cos(a/2), sin(a/2)*axis).
+# The products are expanded below, so no intermediate quaternion or rotated axis is ever built.
+
+def _local_product(cx, sx, cy, sy, cz, sz):
+    return (cy*cx*cz + sy*sx*sz,
+            cy*sx*cz + sy*cx*sz,
+            sy*cx*cz - cy*sx*sz,
+            cy*cx*sz - sy*sx*cz)
+
+def _global_product(cx, sx, cy, sy, cz, sz):
+    return (cz*cx*cy - sz*sx*sy,
+            cz*sx*cy - sz*cx*sy,
+            cz*cx*sy + sz*sx*cy,
+            sz*cx*cy + cz*sx*sy)
+
+def _half_angles(angle_x, angle_y, angle_z):
+    hx, hy, hz = radians(angle_x)/2, radians(angle_y)/2, radians(angle_z)/2
+    return (cos(hx), sin(hx), cos(hy), sin(hy), cos(hz), sin(hz))
+
+def _half_angles_array(angles):
+    half = np.radians(np.asarray(angles, dtype=float))/2
+    c, s = np.cos(half), np.sin(half)
+    return (c[..., 0], s[..., 0], c[..., 1], s[..., 1], c[..., 2], s[..., 2])
+
+# quaternion of the rotation along the LOCAL axis (same result as ele_utils.l_get_quat)
+# @return tuple (w, x, y, z)
+def local_euler_to_quat(angle_x, angle_y, angle_z):
+    return _local_product(*_half_angles(angle_x, angle_y, angle_z))
+
+# quaternion of the rotation along the GLOBAL axis (same result as ele_utils.g_get_quat)
+# @return tuple (w, x, y, z)
+def global_euler_to_quat(angle_x, angle_y, angle_z):
+    return _global_product(*_half_angles(angle_x, angle_y, angle_z))
+
+# batched version of local_euler_to_quat
+# @param angles = array of shape (N, 3) with pitch, yaw and roll
+# @return array of shape (N, 4)
+def local_euler_to_quat_array(angles):
+    return np.stack(_local_product(*_half_angles_array(angles)), axis=-1)
+
+# batched version of global_euler_to_quat
+def global_euler_to_quat_array(angles):
+    return np.stack(_global_product(*_half_angles_array(angles)), axis=-1)
+
+
+
+# sine of the pitch beyond which the rotation is considered in gimbal lock (pitch within about 0.001 degrees of +-90)
+GIMBAL_LOCK = 1 - 1e-10
+
+# given a quaternion representing all the rotations, extract the Euler angles
+# formulas are taken from this WONDERFUL website
+# https://www.euclideanspace.com/maths/geometry/rotations/conversions/quaternionToEuler/index.htm
+# in gimbal lock (pitch = +-90) yaw and roll turn about the same axis and the formulas above divide noise by noise,
+# so roll is set to zero and yaw takes the whole rotation: with q = q_y(yaw)*q_x(+-90) we get yaw = 2*atan2(y, w)
+# @return tuple (pitch, yaw, roll) in degrees, rounded to 6 decimals
+def quat_to_euler(quat):
+    e = -1
+    p0, p2, p1, p3 = quat
+
+    sin_pitch = 2*(p0*p2 + e*p1*p3)
+    if abs(sin_pitch) >= GIMBAL_LOCK:
+        pitch = 90.0 if sin_pitch > 0 else -90.0
+        yaw   = _wrap(degrees(2*atan2(p1, p0)))
+        return (pitch, round(yaw + 0.0, 6), 0.0)
+
+    pitch = asin(sin_pitch)
+    yaw   = atan2(2*(p0*p1 - e*p2*p3), 1-2*(p1**2 + p2**2))
+    roll  = atan2(2*(p0*p3 - e*p1*p2), 1-2*(p2**2 + p3**2))
+
+    # adding 0.0 turns an exact -0.0 into 0.0 as the quaternions of pyquaternion did, tiny negative angles still round to -0.0
+    return (round(degrees(pitch) + 0.0, 6), round(degrees(yaw) + 0.0, 6), round(degrees(roll) + 0.0, 6))
+
+# batched version of quat_to_euler
+# @param quats = array of shape (N, 4)
+# @return array of shape (N, 3) with pitch, yaw and roll in degrees
+def quat_to_euler_array(quats):
+    e = -1
+    quats = np.asarray(quats, dtype=float)
+    p0, p2, p1, p3 = quats[..., 0], quats[..., 1], quats[..., 2], quats[..., 3]
+
+    sin_pitch = 2*(p0*p2 + e*p1*p3)
+    locked = np.abs(sin_pitch) >= GIMBAL_LOCK
+
+    pitch = np.arcsin(np.clip(sin_pitch, -1, 1))
+    yaw   = np.arctan2(2*(p0*p1 - e*p2*p3), 1-2*(p1**2 + p2**2))
+    roll  = np.arctan2(2*(p0*p3 - e*p1*p2), 1-2*(p2**2 + p3**2))
+
+    angles = np.degrees(np.stack((pitch, yaw, roll), axis=-1))
+    if locked.any():
+        angles[locked, 0] = np.copysign(90.0, sin_pitch[locked])
+        angles[locked, 1] = _wrap(np.degrees(2*np.arctan2(p1[locked], p0[locked])))
+        angles[locked, 2] = 0.0
+    return np.round(angles + 0.0, 6)
+
+# Euler angles of the rotation along the GLOBAL axis, the inverse of global_euler_to_quat
+# since q_z*q_x*q_y is the conjugate of q_y(-y)*q_x(-x)*q_z(-z), these are the opposite of the local angles of the conjugate
+# @param quats = array of shape (N, 4)
+# @return array of shape (N, 3) with pitch, yaw and roll in degrees
+def quat_to_global_euler_array(quats):
+    conjugates = np.asarray(quats, dtype=float)*(1, -1, -1, -1)
+    return -quat_to_euler_array(conjugates) + 0.0
+
+# bring an angle in degrees back into the range (-180, 180], as returned by atan2
+def _wrap(angle):
+    return 180 - (180 - angle) % 360
+
+
+
+# Hamilton product of two quaternions given as tuples (w, x, y, z)
+def quat_product(quat_a, quat_b):
+    a_w, a_x, a_y, a_z = quat_a
+    b_w, b_x, b_y, b_z = quat_b
+    return (a_w*b_w - a_x*b_x - a_y*b_y - a_z*b_z,
+            a_w*b_x + a_x*b_w + a_y*b_z - a_z*b_y,
+            a_w*b_y - a_x*b_z + a_y*b_w + a_z*b_x,
+            a_w*b_z + a_x*b_y - a_y*b_x + a_z*b_w)
+
+# batched version of quat_product
+# @param quats_a, quats_b = arrays of shape (N, 4) or (4,), broadcast against each other
+# @return the Hamilton product quats_a*quats_b with shape (N, 4)
+def quat_multiply(quats_a, quats_b):
+    quats_a = np.asarray(quats_a, dtype=float)
+    quats_b = np.asarray(quats_b, dtype=float)
+    if quats_a.ndim == 1:
+        # the same rotation applied to every quaternion is a single matrix product
+        return quats_b @ quat_left_matrix(quats_a).T
+    a_w, a_x, a_y, a_z = quats_a[..., 0], quats_a[..., 1], quats_a[..., 2], quats_a[..., 3]
+    b_w, b_x, b_y, b_z = quats_b[..., 0], quats_b[..., 1], quats_b[..., 2], quats_b[..., 3]
+    return np.stack((a_w*b_w - a_x*b_x - a_y*b_y - a_z*b_z,
+                     a_w*b_x + a_x*b_w + a_y*b_z - a_z*b_y,
+                     a_w*b_y - a_x*b_z + a_y*b_w + a_z*b_x,
+                     a_w*b_z + a_x*b_y - a_y*b_x + a_z*b_w), axis=-1)
+
+# matrix M such that M @ b is the product quat*b
+def quat_left_matrix(quat):
+    w, x, y, z = quat
+    return np.array([[w, -x, -y, -z],
+                     [x,  w, -z,  y],
+                     [y,  z,  w, -x],
+                     [z, -y,  x,  w]], dtype=float)
+
+# rotation matrix equivalent to the sandwich product q*v*q.conjugate of a unit quaternion
+# @param quat = quaternion (w, x, y, z) or array of shape (N, 4)
+# @return matrix of shape (3, 3) or array of shape (N, 3, 3)
+def quat_to_matrix(quat):
+    quat = np.asarray(quat, dtype=float)
+    w, x, y, z = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
+    return np.stack((np.stack((1 - 2*(y*y + z*z),     2*(x*y - w*z),     2*(x*z + w*y)), axis=-1),
+                     np.stack((    2*(x*y + w*z), 1 - 2*(x*x + z*z),     2*(y*z - w*x)), axis=-1),
+                     np.stack((    2*(x*z - w*y),     2*(y*z + w*x), 1 - 2*(x*x + y*y)), axis=-1)), axis=-2)
+
+# apply the same rotation to many points at once
+# @param positions = array of shape (N, 3) with the coordinates of the objects to rotate
+# @param center = coordinates of the center of rotation
+# @param quat = the rotation expressed as a quaternion (w, x, y, z)
+# @return array of shape (N, 3) with the rotated coordinates
+def rotate_array(positions, center, quat):
+    center = np.asarray(center, dtype=float)
+    matrix = quat_to_matrix(quat)
+    return center + (np.asarray(positions, dtype=float) - center) @ matrix.T
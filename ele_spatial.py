@@ -0,0 +1,281 @@
+import numpy as np
+
+
+
+# radius of the sphere around an item which is considered occupied by it, when its item ID has no radius of its own
+DEFAULT_RADIUS = 0.5
+
+# distance under which two items with the same item ID are the same item placed twice
+DUPLICATE_TOLERANCE = 1e-3
+
+# cells are numbered with 21 bits per axis, packed in a single integer
+_CELL_BITS = 21
+_CELL_BIAS = 1 << (_CELL_BITS - 1)
+
+# neighbouring cells visited when looking for pairs, each pair of adjacent cells is visited once
+_HALF_NEIGHBOURHOOD = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if (dx, dy, dz) > (0, 0, 0)]
+
+def _encode(cells):
+    cells = np.asarray(cells, dtype=np.int64) + _CELL_BIAS
+    return (cells[..., 0] << (2*_CELL_BITS)) | (cells[..., 1] << _CELL_BITS) | cells[..., 2]
+
+# positions of the items found in the given ranges of an array
+# @return (repeated, gathered) where repeated[k] is the index of the range of the k-th item and gathered[k] its position
+def _gather(begin, end):
+    counts = end - begin
+    repeated = np.repeat(np.arange(len(begin)), counts)
+    starts = np.cumsum(counts) - counts
+    gathered = np.arange(counts.sum()) - np.repeat(starts, counts) + np.repeat(begin, counts)
+    return repeated, gathered
+
+# pairs of items within a distance from each other
+# @param positions = array of shape (N, 3)
+# @param groups = array of shape (N,), if given only items of the same group are paired, for example the same item ID
+# @return (first, second) arrays with the indices of the two items of each pair, each pair once in any order
+def close_pairs(positions, distance, groups=None):
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    # with cells as large as the distance, paired items lie in the same or in adjacent cells
+    cells = np.floor(positions/distance).astype(np.int64)
+    order = np.argsort(_encode(cells), kind="stable")
+    cells = cells[order]
+    keys = _encode(cells)
+
+    firsts = list()
+    seconds = list()
+    for offset in [(0, 0, 0)] + _HALF_NEIGHBOURHOOD:
+        targets = _encode(cells + offset)
+        first, second = _gather(np.searchsorted(keys, targets, side="left"), np.searchsorted(keys, targets, side="right"))
+        if offset == (0, 0, 0):
+            keep = first < second
+            first, second = first[keep], second[keep]
+        first, second = order[first], order[second]
+        # pairs are filtered cell by cell, so only the joined ones are kept at the same time
+        keep = np.linalg.norm(positions[first] - positions[second], axis=1) <= distance
+        if groups is not None:
+            keep &= groups[first] == groups[second]
+        firsts.append(first[keep])
+        seconds.append(second[keep])
+    return (np.concatenate(firsts + [np.zeros(0, dtype=np.int64)]),
+            np.concatenate(seconds + [np.zeros(0, dtype=np.int64)]))
+
+# group the items into clusters, where two items are in the same cluster if a chain of items joins them
+# and each item of the chain is within a distance from the next one
+# @param positions = array of shape (N, 3)
+# @param groups = array of shape (N,), if given only items of the same group are joined, for example the same item ID
+# @return array of shape (N,) with the cluster of each item, numbered from 0 in order of their first item
+def clusters(positions, distance, groups=None):
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    first, second = close_pairs(positions, distance, groups)
+    labels, _ = _components(len(positions), first, second)
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+# connected components of a graph, as a forest where every node points to a lower one
+# in each round the root of every tree joined to a lower tree is hooked to the lowest of them, then every node is
+# pointed straight to its root: each tree is merged with at least another one, so there are about log2(n) rounds
+# @param first, second = arrays with the two nodes of each edge
+# @return (labels, rounds) where labels[k] is the lowest node of the component of node k
+def _components(n, first, second):
+    labels = np.arange(n)
+    rounds = 0
+    while len(first):
+        rounds += 1
+        low = np.minimum(labels[first], labels[second])
+        high = np.maximum(labels[first], labels[second])
+        # edges inside a tree stay there, so they are dropped
+        joined = low != high
+        if not joined.any():
+            break
+        first, second = first[joined], second[joined]
+        np.minimum.at(labels, high[joined], low[joined])
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return labels, rounds
+
+
+
+# Uniform grid over the items of the placed instances.
+# Every item is a sphere centered in its position, whose radius depends on its item ID. The space is divided in cubic
+# cells as large as the biggest sphere, so two items can touch only if they lie in the same or in adjacent cells.
+# The items are kept sorted by cell, and the items of a cell are found by binary search.
+#
+# Instances are added and removed one by one: their items are merged into the sorted order or dropped from it,
+# without sorting everything again. Items are reported as (instance, index of the item in the instance).
+class SpatialIndex:
+    def __init__(self, radii=None, default_radius=DEFAULT_RADIUS):
+        self.radii = dict() if radii is None else dict(radii)
+        self.default_radius = default_radius
+        self.cell_size = 2*max([default_radius] + list(self.radii.values()))
+        self.clear()
+
+    def clear(self):
+        # one row per item ever added, removed ones are kept until compact
+        self._size = 0
+        self._positions = np.zeros((0, 3))
+        self._radii = np.zeros(0)
+        self._item_ids = np.zeros(0, dtype=np.int64)
+        self._owners = np.zeros(0, dtype=np.int64)
+        self._rows = np.zeros(0, dtype=np.int64)
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._alive = np.zeros(0, dtype=bool)
+        # numbers given to item IDs and instances
+        self._item_codes = dict()
+        self._instances = list()
+        self._slots = dict()
+        # rows of the items present, sorted by cell
+        self._order = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, instance):
+        return id(instance) in self._slots
+
+    def _cells(self, positions):
+        return np.floor(np.asarray(positions, dtype=float)/self.cell_size).astype(np.int64)
+
+    def _grow(self, n):
+        if self._size + n <= len(self._alive):
+            return
+        capacity = max(self._size + n, 2*len(self._alive), 64)
+        for name in ("_positions", "_radii", "_item_ids", "_owners", "_rows", "_keys", "_alive"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    # store the items of an instance not present, without sorting them yet
+    # @return the rows of the items
+    def _append(self, instance):
+        items = instance.items
+        n = len(items)
+        self._grow(n)
+        slots = np.arange(self._size, self._size + n)
+        self._size += n
+
+        owner = len(self._instances)
+        self._instances.append(instance)
+        self._slots[id(instance)] = (owner, slots)
+
+        self._positions[slots] = items.positions
+        self._radii[slots] = [self.radii.get(item_id, self.default_radius) for item_id in items.item_ids]
+        self._item_ids[slots] = [self._item_codes.setdefault(item_id, len(self._item_codes)) for item_id in items.item_ids]
+        self._owners[slots] = owner
+        self._rows[slots] = np.arange(n)
+        self._keys[slots] = _encode(self._cells(items.positions))
+        self._alive[slots] = True
+        return slots
+
+    # the new items are sorted on their own and merged into the order
+    def _merge(self, slots):
+        new_order = slots[np.argsort(self._keys[slots], kind="stable")]
+        where = np.searchsorted(self._keys[self._order], self._keys[new_order], side="right")
+        self._order = np.insert(self._order, where, new_order)
+
+    # add an instance, or update it if already present
+    def add(self, instance):
+        self.extend((instance,))
+
+    # add many instances, merging their items into the order all together
+    def extend(self, instances):
+        instances = list(instances)
+        for instance in instances:
+            if instance in self:
+                self.remove(instance)
+        slots = [self._append(instance) for instance in instances]
+        self._merge(np.concatenate(slots + [np.zeros(0, dtype=np.int64)]))
+
+    def remove(self, instance):
+        self.remove_many((instance,))
+
+    # remove many instances, dropping their items from the order all together
+    def remove_many(self, instances):
+        for instance in instances:
+            owner, slots = self._slots.pop(id(instance))
+            self._instances[owner] = None
+            self._alive[slots] = False
+        self._order = self._order[self._alive[self._order]]
+        # the space of removed items is reclaimed once they are the majority
+        if self._size > 64 and 2*len(self._order) < self._size:
+            self.compact()
+
+    # to be called after moving an instance
+    def update(self, instance):
+        self.add(instance)
+
+    # drop the rows of the removed items and renumber the instances
+    def compact(self):
+        instances = [instance for instance in self._instances if instance is not None]
+        self.clear()
+        self.extend(instances)
+
+    def _item(self, row):
+        return (self._instances[self._owners[row]], int(self._rows[row]))
+
+    # pairs of rows (first, second) of the items in the same or in adjacent cells, each pair once
+    def _candidate_pairs(self):
+        order = self._order
+        keys = self._keys[order]
+        cells = self._cells(self._positions[order])
+        firsts = list()
+        seconds = list()
+        for offset in [(0, 0, 0)] + _HALF_NEIGHBOURHOOD:
+            targets = _encode(cells + offset)
+            begin = np.searchsorted(keys, targets, side="left")
+            end = np.searchsorted(keys, targets, side="right")
+            first, second = _gather(begin, end)
+            if offset == (0, 0, 0):
+                keep = first < second
+                first, second = first[keep], second[keep]
+            firsts.append(order[first])
+            seconds.append(order[second])
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+    # items whose spheres intersect
+    # @param same_instance = also report items of the same instance, which usually overlap by design
+    # @param tolerance = overlaps not deeper than this are ignored
+    # @return list of (instance, item, other instance, other item, depth) from the deepest one
+    def overlaps(self, same_instance=False, tolerance=0.0):
+        first, second = self._candidate_pairs()
+        if not same_instance:
+            keep = self._owners[first] != self._owners[second]
+            first, second = first[keep], second[keep]
+        distances = np.linalg.norm(self._positions[first] - self._positions[second], axis=1)
+        depths = self._radii[first] + self._radii[second] - distances
+        keep = depths > tolerance
+        first, second, depths = first[keep], second[keep], depths[keep]
+        sorting = np.argsort(-depths, kind="stable")
+        return [self._item(a) + self._item(b) + (depth,)
+                for a, b, depth in zip(first[sorting].tolist(), second[sorting].tolist(), depths[sorting].tolist())]
+
+    # items with the same item ID placed at the same position, any rotation
+    # @return list of (instance, item, other instance, other item)
+    def duplicates(self, tolerance=DUPLICATE_TOLERANCE):
+        first, second = self._candidate_pairs()
+        keep = self._item_ids[first] == self._item_ids[second]
+        first, second = first[keep], second[keep]
+        keep = np.linalg.norm(self._positions[first] - self._positions[second], axis=1) <= tolerance
+        return [self._item(a) + self._item(b) for a, b in zip(first[keep].tolist(), second[keep].tolist())]
+
+    # items whose center is within a distance from a point
+    # @return list of (instance, item, distance) from the nearest one
+    def near(self, point, distance):
+        point = np.asarray(point, dtype=float)
+        low = self._cells(point - distance)
+        high = self._cells(point + distance)
+        if np.prod(high - low + 1) <= len(self._order):
+            # only the cells overlapping the sphere are searched
+            keys = self._keys[self._order]
+            axes = np.meshgrid(*[np.arange(low[axis], high[axis] + 1) for axis in range(3)], indexing="ij")
+            targets = _encode(np.stack(axes, axis=-1).reshape(-1, 3))
+            _, found = _gather(np.searchsorted(keys, targets, side="left"), np.searchsorted(keys, targets, side="right"))
+            rows = self._order[found]
+        else:
+            rows = self._order
+        distances = np.linalg.norm(self._positions[rows] - point, axis=1)
+        keep = distances <= distance
+        rows, distances = rows[keep], distances[keep]
+        sorting = np.argsort(distances, kind="stable")
+        return [self._item(row) + (d,) for row, d in zip(rows[sorting].tolist(), distances[sorting].tolist())]
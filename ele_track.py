@@ -0,0 +1,307 @@
+import os
+import re
+import sys
+import argparse
+
+import numpy as np
+
+import ele_loader
+import ele_project
+import ele_spatial
+
+
+
+# items closer than this, in meters, belong to the same piece when a track is split
+SPLIT_DISTANCE = 1.5
+
+# written around the items of a blueprint file, the XSD declaration is needed for parsing
+BLUEPRINT_HEADER = '  <blueprints xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+BLUEPRINT_FOOTER = '\n  </blueprints>'
+
+# bytes of the track read at once by merge_track, and items joined together for each write
+READ_SIZE = 1 << 20
+WRITE_CHUNK_SIZE = 1024
+
+# tags looked for by merge_track, all of them shorter than _MARGIN bytes
+_TAGS = re.compile(rb'<(?:(?P<empty>blueprints\s*/>)|(?P<start>blueprints\b[^>]*>)|(?P<end>/blueprints\s*>)'
+                   rb'|(?P<last>lastTrackItemID\s*/>|lastTrackItemID>\s*(?P<value>\d*)\s*</lastTrackItemID>)'
+                   rb'|(?P<track>/Track\s*>))')
+_INSTANCE_IDS = re.compile(rb'<instanceID>\s*(\d+)\s*</instanceID>')
+_ITEM_IDS = re.compile(rb'<(?:instanceID|lastTrackItemID)>\s*(\d+)\s*</')
+_MARGIN = 512
+
+
+
+'''
+Structure of a Liftoff track file, as found in the Tracks folder of the game
+
+<?xml version="1.0" encoding="utf-8"?>
+<Track xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <gameVersion>...</gameVersion>
+  <localID>...</localID>
+  <name>...</name>
+  ...
+  <blueprints>
+    <TrackBlueprint xsi:type="TrackBlueprintFlag">
+      ... as in a blueprint file, see ele_loader
+    </TrackBlueprint>
+  </blueprints>
+  <lastTrackItemID>...</lastTrackItemID>
+</Track>
+
+Importing a track takes the place of copying its "blueprints" tag into the blueprints folder by hand. The file is read
+incrementally, so even large tracks are never held in memory as a tree. Only the item ID, position and rotation of
+each item are kept, as in the blueprints folder.
+'''
+
+# name of the blueprint made from a track file, its file name without extension
+def default_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+# the whole track as a single blueprint, centered where the track is
+# @param source = path or file object of the track
+# @return the new blueprint
+def import_track(source, name):
+    return ele_loader.make_blueprint(name, ele_loader.parse_items(source))
+
+# split a track into pieces, each one a blueprint centered on itself
+# items closer than distance, directly or through other items, end up in the same piece
+# @param same_item_id = join only items with the same item ID, so that each piece is made of a single kind of item
+# @return (blueprints, placements) with the blueprints named name_1, name_2, ... in order of their first item
+#         and an array of shape (K, 6) with the placement of each one, which rebuilds the track as a project
+def split_track(source, name, distance=SPLIT_DISTANCE, same_item_id=False):
+    item_ids, instance_ids, positions, rotations, quats = ele_loader.parse_items(source)
+    groups = None
+    if same_item_id:
+        codes = dict()
+        groups = np.array([codes.setdefault(item_id, len(codes)) for item_id in item_ids], dtype=np.int64)
+    labels = ele_spatial.clusters(positions, distance, groups)
+
+    n_pieces = int(labels.max()) + 1 if len(labels) else 0
+    # the items of each piece are found by sorting the labels once
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(n_pieces + 1))
+    blueprints = list()
+    placements = np.zeros((n_pieces, 6))
+    for k in range(n_pieces):
+        rows = order[bounds[k]:bounds[k + 1]]
+        # the center of a piece is the middle of its bounding box, at the height of the track
+        low = positions[rows].min(axis=0)
+        high = positions[rows].max(axis=0)
+        center = ((low[0] + high[0])/2, 0.0, (low[2] + high[2])/2)
+        arrays = ([item_ids[row] for row in rows.tolist()],
+                  np.arange(1, len(rows) + 1, dtype=np.int64),
+                  positions[rows] - center,
+                  rotations[rows],
+                  quats[rows])
+        blueprints.append(ele_loader.make_blueprint("{}_{}".format(name, k + 1), arrays))
+        placements[k, :3] = center
+    return blueprints, placements
+
+# highest instance ID used by the items of a track, or its lastTrackItemID if higher, 0 for a track without items
+# the file is read in blocks, like merge_track does
+def highest_instance_id(path, read_size=READ_SIZE):
+    highest = 0
+    tail = b""
+    with open(path, "rb") as source:
+        while True:
+            data = source.read(read_size)
+            # the end of the previous block is read again, in case a tag was cut there
+            buffer = tail + data
+            highest = max([highest] + [int(value) for value in _ITEM_IDS.findall(buffer)])
+            if not data:
+                return highest
+            tail = buffer[-_MARGIN:]
+
+# write a blueprint file that can be placed in the blueprints folder
+def write_blueprint(file, blueprint):
+    file.write(BLUEPRINT_HEADER)
+    for piece in blueprint.iter_xml():
+        file.write(piece)
+    file.write(BLUEPRINT_FOOTER)
+
+# Copies a track into another file, replacing its items on the way. The track is read in blocks and written as soon as
+# no tag can be cut at the end of a block, so it is never held in memory. Only the "blueprints" and "lastTrackItemID"
+# tags are touched, everything else is copied byte by byte.
+class _TrackMerger:
+    def __init__(self, target, pieces, last_item_id, first_item_id, append):
+        self.target = target
+        self.pieces = pieces
+        self.last_item_id = last_item_id
+        self.first_item_id = first_item_id
+        self.append = append
+        # the items are written with the line endings of the track, found at its first newline
+        self.newline = "\n"
+        self._newline_found = False
+        self._last_byte = b""
+        # between the tags of the blueprints section, whose content is copied only when appending
+        self.inside = False
+        # whitespace before the closing tag, kept so that the new items go before it
+        self.space = b""
+        self.merged = False
+        self.updated = False
+        # highest instance ID used by the items kept, or by the lastTrackItemID of the track
+        self.highest = 0
+
+    def write(self, text):
+        self.target.write(text.replace("\n", self.newline).encode("utf-8"))
+
+    def copy(self, data):
+        if not self.inside:
+            self.target.write(data)
+            return
+        body = data.rstrip()
+        if body:
+            if self.append:
+                self.highest = max([self.highest] + [int(value) for value in _INSTANCE_IDS.findall(body)])
+                self.target.write(self.space + body)
+            self.space = data[len(body):]
+        else:
+            self.space += data
+
+    def write_items(self):
+        if self.append and self.first_item_id is not None and self.first_item_id <= self.highest:
+            raise ValueError("the track already uses instance IDs up to {}, the ones of the project start from {}".format(self.highest, self.first_item_id))
+        chunk = list()
+        for piece in self.pieces:
+            chunk.append(piece)
+            if len(chunk) >= WRITE_CHUNK_SIZE:
+                self.write(''.join(chunk))
+                chunk.clear()
+        self.write(''.join(chunk))
+        self.merged = True
+
+    def last_item_tag(self):
+        self.updated = True
+        last_item_id = max(self.last_item_id, self.highest) if self.append else self.last_item_id
+        return "<lastTrackItemID>{}</lastTrackItemID>".format(last_item_id)
+
+    def tag(self, match):
+        if match.group("empty"):
+            self.write("<blueprints>")
+            self.write_items()
+            self.write("\n  </blueprints>")
+        elif match.group("start"):
+            self.copy(match.group())
+            self.inside = True
+        elif match.group("end") and self.inside:
+            self.write_items()
+            self.target.write(self.space or self.newline.encode() + b"  ")
+            self.space = b""
+            self.inside = False
+            self.copy(match.group())
+        elif match.group("last"):
+            if match.group("value"):
+                self.highest = max(self.highest, int(match.group("value")))
+            self.write(self.last_item_tag())
+        elif match.group("track"):
+            # a track without items may lack the tags altogether
+            if not self.merged:
+                self.write("  <blueprints>")
+                self.write_items()
+                self.write("\n  </blueprints>\n")
+            if not self.updated:
+                self.write("  " + self.last_item_tag() + "\n")
+            self.copy(match.group())
+        else:
+            self.copy(match.group())
+
+    # look for the first newline of the track, which may be in any block and have its \r at the end of the previous one
+    def detect_newline(self, data):
+        if self._newline_found or not data:
+            return
+        index = data.find(b"\n")
+        if index < 0:
+            self._last_byte = data[-1:]
+            return
+        before = data[index - 1:index] if index > 0 else self._last_byte
+        self.newline = "\r\n" if before == b"\r" else "\n"
+        self._newline_found = True
+
+    def run(self, source, read_size):
+        buffer = b""
+        while True:
+            data = source.read(read_size)
+            self.detect_newline(data)
+            buffer += data
+            # at the end of the file everything is processed, before that the last bytes wait for the next block
+            limit = len(buffer) if not data else len(buffer) - _MARGIN
+            position = 0
+            for match in _TAGS.finditer(buffer):
+                if match.start() >= limit:
+                    break
+                self.copy(buffer[position:match.start()])
+                self.tag(match)
+                position = match.end()
+            end = max(position, limit)
+            if data:
+                # the block is cut before an opening tag, so that no instanceID is split between two blocks
+                cut = end
+                while cut > position:
+                    cut = buffer.rfind(b"<", position, cut)
+                    if buffer[cut + 1:cut + 2] != b"/":
+                        break
+                if cut > position:
+                    end = cut
+            self.copy(buffer[position:end])
+            buffer = buffer[end:]
+            if not data:
+                break
+
+# write the items of a project into a track file saved by Liftoff, replacing the items it has
+# @param pieces = XML code of the items, as produced by Program.iter_items
+# @param last_item_id = value of lastTrackItemID, the highest instance ID of the project
+# @param first_item_id = lowest instance ID of the project, checked against the items kept with append
+# @param output = file written, by default the track itself; it is replaced only once the whole track is written
+# @param append = keep the items already in the track
+# @raise ValueError if the file is not a track, or with append if the instance IDs of the project are already used
+def merge_track(path, pieces, last_item_id, first_item_id=None, output=None, append=False, read_size=READ_SIZE):
+    output = path if output is None else output
+    temporary = "{}.{}.tmp".format(output, os.getpid())
+    try:
+        with open(path, "rb") as source, open(temporary, "wb") as target:
+            merger = _TrackMerger(target, pieces, last_item_id, first_item_id, append)
+            merger.run(source, read_size)
+        if not merger.merged:
+            raise ValueError("{} is not a Liftoff track".format(path))
+        os.replace(temporary, output)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import the items of a Liftoff track as blueprints")
+    parser.add_argument("track", help="track file saved by Liftoff")
+    parser.add_argument("-o", "--output", default=ele_loader.BLUEPRINTS_DIRECTORY, help="folder receiving the blueprints")
+    parser.add_argument("-n", "--name", default=None, help="name of the blueprints (default: name of the track file)")
+    parser.add_argument("-s", "--split", action="store_true", help="split the track into a blueprint for each piece")
+    parser.add_argument("--distance", type=float, default=SPLIT_DISTANCE, help="items closer than this belong to the same piece")
+    parser.add_argument("--same-item-id", action="store_true", help="join only items with the same item ID into a piece")
+    parser.add_argument("-p", "--project", default=None, help="with --split, also save the placements of the pieces as a project")
+    args = parser.parse_args(argv)
+    if args.distance <= 0:
+        parser.error("the distance must be positive")
+
+    name = args.name or default_name(args.track)
+    if args.split:
+        blueprints, placements = split_track(args.track, name, args.distance, args.same_item_id)
+    else:
+        blueprints, placements = [import_track(args.track, name)], np.zeros((1, 6))
+
+    os.makedirs(args.output, exist_ok=True)
+    for blueprint in blueprints:
+        with open(os.path.join(args.output, blueprint.name + ".xml"), "w") as file:
+            write_blueprint(file, blueprint)
+    if args.project is not None:
+        names = [blueprint.name for blueprint in blueprints]
+        if args.project.endswith(ele_project.BINARY_EXTENSION):
+            ele_project.write_binary(args.project, names, placements)
+        else:
+            with open(args.project, "w") as file:
+                ele_project.write_text(file, names, placements)
+    print("{} blueprints, {} items written to {}".format(len(blueprints), sum(len(blueprint.items) for blueprint in blueprints), args.output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
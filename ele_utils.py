@@ -1,7 +1,12 @@
 import numpy as np
-from math import radians, degrees, asin, atan2
+from math import radians
 from pyquaternion import Quaternion
 
+import ele_profile
+
+from ele_rotation import local_euler_to_quat, global_euler_to_quat, global_euler_to_quat_array, \
+                         quat_to_euler, quat_to_euler_array, quat_product, quat_multiply, quat_to_matrix, rotate_array
+
 
 
 # apply arbitrary rotation on a point using a quaternion
@@ -94,97 +99,272 @@ def g_get_quat(angle_x, angle_y, angle_z):
 
 
 
+# identity orientation of the local axis
+AXIS = ( Quaternion(w=0, x=1, y=0, z=0),
+         Quaternion(w=0, x=0, y=1, z=0),
+         Quaternion(w=0, x=0, y=0, z=1) )
+
+
+
+# structure-of-arrays storage for the items of a blueprint
+# every field is a column with one row per item, so an item costs about a hundred bytes
+# instead of a Python object with a dictionary of attributes and four Quaternion objects
+# - item_ids is a list of (shared) strings
+# - instance_ids is an array of integers
+# - positions and rotations are arrays of shape (N, 3), rotations holding pitch, yaw and roll
+# - quats is an array of shape (N, 4) with the quaternion of the overall rotation of each item
+# the columns are views over buffers which grow geometrically, so appending is amortized O(1)
+class ItemTable:
+    def __init__(self, capacity=16):
+        self.size = 0
+        self.item_ids = list()
+        self._instance_ids = np.zeros(capacity, dtype=np.int64)
+        self._positions = np.zeros((capacity, 3))
+        self._rotations = np.zeros((capacity, 3))
+        self._quats = np.zeros((capacity, 4))
+
+    @property
+    def instance_ids(self):
+        return self._instance_ids[:self.size]
+
+    @instance_ids.setter
+    def instance_ids(self, values):
+        self._instance_ids[:self.size] = values
+
+    @property
+    def positions(self):
+        return self._positions[:self.size]
+
+    @positions.setter
+    def positions(self, values):
+        self._positions[:self.size] = values
+
+    @property
+    def rotations(self):
+        return self._rotations[:self.size]
+
+    @rotations.setter
+    def rotations(self, values):
+        self._rotations[:self.size] = values
+
+    @property
+    def quats(self):
+        return self._quats[:self.size]
+
+    @quats.setter
+    def quats(self, values):
+        self._quats[:self.size] = values
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._instance_ids):
+            return
+        capacity = max(capacity, 2*len(self._instance_ids))
+        for name in ("_instance_ids", "_positions", "_rotations", "_quats"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    # add a single item
+    # @param position = tuple (x, y, z)
+    # @param rotation = tuple (pitch, yaw, roll) in degrees
+    # @param quat = quaternion (w, x, y, z) of the rotation, computed from the Euler angles if missing
+    def append(self, item_id, instance_id, position, rotation, quat=None):
+        if quat is None:
+            # initial orientation is based on LOCAL axis
+            quat = local_euler_to_quat(rotation[0], rotation[1], rotation[2])
+        self._reserve(self.size + 1)
+        index = self.size
+        self.item_ids.append(item_id)
+        self._instance_ids[index] = int(instance_id)
+        self._positions[index] = position
+        self._rotations[index] = rotation
+        self._quats[index] = quat
+        self.size += 1
+
+    # add many items at once, all the arrays must have the same number of rows
+    def extend(self, item_ids, instance_ids, positions, rotations, quats):
+        count = len(item_ids)
+        self._reserve(self.size + count)
+        self.item_ids.extend(item_ids)
+        self._instance_ids[self.size:self.size+count] = instance_ids
+        self._positions[self.size:self.size+count] = positions
+        self._rotations[self.size:self.size+count] = rotations
+        self._quats[self.size:self.size+count] = quats
+        self.size += count
+
+    # build a table around existing arrays, which are not copied
+    @classmethod
+    def from_arrays(cls, item_ids, instance_ids, positions, rotations, quats):
+        table = cls.__new__(cls)
+        table.size = len(item_ids)
+        table.item_ids = item_ids
+        table._instance_ids = instance_ids
+        table._positions = positions
+        table._rotations = rotations
+        table._quats = quats
+        return table
+
+    def copy(self):
+        copied_table = ItemTable(max(self.size, 1))
+        copied_table.extend(self.item_ids, self.instance_ids, self.positions, self.rotations, self.quats)
+        return copied_table
+
+    def nbytes(self):
+        return self._instance_ids.nbytes + self._positions.nbytes + self._rotations.nbytes + self._quats.nbytes + \
+               8*len(self.item_ids)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError("item index out of range")
+        return Item.view(self, index)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield Item.view(self, index)
+
+
+
+# property reading and writing one coordinate of the row of an item
+def _column(name, axis):
+    def getter(item):
+        return float(getattr(item._table, name)[item._index, axis])
+    def setter(item, value):
+        getattr(item._table, name)[item._index, axis] = value
+    return property(getter, setter)
+
+# an item is a thin view over one row of an ItemTable
+# items created with the constructor own a private table with a single row, so they can be
+# used standalone and later added to a blueprint, which copies their row into its own table
 class Item:
+    __slots__ = ("_table", "_index")
+
     def __init__(self, item_id, instance_id, pos_x, pos_y, pos_z, rot_x, rot_y, rot_z):
-        self.item_id = item_id
-        self.instance_id = instance_id
-
-        self.pos_x = pos_x
-        self.pos_y = pos_y
-        self.pos_z = pos_z
-        
-        self.rot_x = rot_x
-        self.rot_y = rot_y
-        self.rot_z = rot_z
-        
-        # orientation of the local axis
-        self.orientation = ( Quaternion(w=0, x=1, y=0, z=0),
-                             Quaternion(w=0, x=0, y=1, z=0),
-                             Quaternion(w=0, x=0, y=0, z=1) )
-        
-        # quaternion representing the initial rotation
-        self.quat = None
-        
-        # initialize the orientation of the local axis and the initial quaternion
-        self._init_quat()
-
-    # initial orientation is based on LOCAL axis
-    def _init_quat(self):
-        new_orientation = l_rotate(self.orientation, self.rot_x, self.rot_y, self.rot_z)
-        new_quat = l_get_quat(self.orientation, self.rot_x, self.rot_y, self.rot_z)
-        
-        self.orientation = new_orientation
-        self.quat = new_quat
+        self._table = ItemTable(1)
+        self._index = 0
+        # the quaternion representing the initial rotation is computed by the table
+        self._table.append(item_id, instance_id, (pos_x, pos_y, pos_z), (rot_x, rot_y, rot_z))
+
+    @classmethod
+    def view(cls, table, index):
+        item = cls.__new__(cls)
+        item._table = table
+        item._index = index
+        return item
+
+    @property
+    def item_id(self):
+        return self._table.item_ids[self._index]
+
+    @item_id.setter
+    def item_id(self, value):
+        self._table.item_ids[self._index] = value
+
+    @property
+    def instance_id(self):
+        return int(self._table._instance_ids[self._index])
+
+    @instance_id.setter
+    def instance_id(self, value):
+        self._table._instance_ids[self._index] = value
+
+    pos_x, pos_y, pos_z = _column("_positions", 0), _column("_positions", 1), _column("_positions", 2)
+    rot_x, rot_y, rot_z = _column("_rotations", 0), _column("_rotations", 1), _column("_rotations", 2)
+
+    # quaternion representing the overall rotation
+    @property
+    def quat(self):
+        return Quaternion(self._table._quats[self._index])
+
+    @quat.setter
+    def quat(self, value):
+        self._table._quats[self._index] = value.elements if isinstance(value, Quaternion) else value
+
+    # orientation of the local axis, derived from the quaternion
+    @property
+    def orientation(self):
+        quat = self.quat
+        return tuple(quat*axis*quat.conjugate for axis in AXIS)
 
     def translate(self, x, y, z):
-        self.pos_x += x
-        self.pos_y += y
-        self.pos_z += z
+        self._table._positions[self._index] += (x, y, z)
     
     def rotate(self, pitch, yaw, roll):
-        self.orientation = g_rotate(self.orientation, pitch, yaw, roll)
         # final_quat is the product of two rotations:
         # - the initial one when the item is placed inside the blueprint
         # - the last one when the blueprint itself is rotated in the world
-        final_quat = g_get_quat(pitch, yaw, roll)*self.quat
+        final_quat = quat_product(global_euler_to_quat(pitch, yaw, roll), self._table._quats[self._index].tolist())
+        self._table._quats[self._index] = final_quat
         self.rot_x, self.rot_y, self.rot_z = self._get_pitch_yaw_roll(final_quat)
     
     def _get_pitch_yaw_roll(self, quaternion):
         # given a quaternion representing all the rotations, extract the Euler angles
-        # formulas are taken from this WONDERFUL website
-        # https://www.euclideanspace.com/maths/geometry/rotations/conversions/quaternionToEuler/index.htm
-        e = -1
-        p0 = quaternion.w
-        p1 = quaternion.y
-        p2 = quaternion.x
-        p3 = quaternion.z
-
-        pitch = asin(2*(p0*p2 + e*p1*p3))
-        yaw   = atan2(2*(p0*p1 - e*p2*p3), 1-2*(p1**2 + p2**2))
-        roll  = atan2(2*(p0*p3 - e*p1*p2), 1-2*(p2**2 + p3**2))
-        
-        pitch = round(degrees(pitch), 6)
-        yaw   = round(degrees(yaw), 6)
-        roll  = round(degrees(roll), 6)
-        
-        return (pitch, yaw, roll)
+        if isinstance(quaternion, Quaternion):
+            quaternion = quaternion.elements
+        return quat_to_euler(quaternion)
 
     def copy(self):
-        return Item(self.item_id, self.instance_id, self.pos_x, self.pos_y, self.pos_z, self.rot_x, self.rot_y, self.rot_z)
+        table = ItemTable(1)
+        table.append(self.item_id, self.instance_id,
+                     self._table._positions[self._index], self._table._rotations[self._index], self._table._quats[self._index])
+        return Item.view(table, 0)
 
     def __str__(self):
-        return ('\n    <TrackBlueprint xsi:type="TrackBlueprintFlag">' + \
-                '\n      <itemID>{}</itemID>' + \
-                '\n      <instanceID>{}</instanceID>' + \
-                '\n      <position>' + \
-                '\n        <x>{}</x>' + \
-                '\n        <y>{}</y>' + \
-                '\n        <z>{}</z>' + \
-                '\n      </position>' + \
-                '\n      <rotation>' + \
-                '\n        <x>{}</x>' + \
-                '\n        <y>{}</y>' + \
-                '\n        <z>{}</z>' + \
-                '\n      </rotation>' + \
-                '\n      <purpose>Functional</purpose>' + \
-                '\n    </TrackBlueprint>').format(self.item_id,
-                                                  self.instance_id,
-                                                  round(self.pos_x, 3),
-                                                  round(self.pos_y, 3),
-                                                  round(self.pos_z, 3),
-                                                  round(self.rot_x, 3),
-                                                  round(self.rot_y, 3),
-                                                  round(self.rot_z, 3))
+        return format_item(self.item_id, self.instance_id,
+                           self.pos_x, self.pos_y, self.pos_z,
+                           self.rot_x, self.rot_y, self.rot_z)
+
+
+
+ITEM_XML = '\n    <TrackBlueprint xsi:type="TrackBlueprintFlag">' + \
+           '\n      <itemID>{}</itemID>' + \
+           '\n      <instanceID>{}</instanceID>' + \
+           '\n      <position>' + \
+           '\n        <x>{}</x>' + \
+           '\n        <y>{}</y>' + \
+           '\n        <z>{}</z>' + \
+           '\n      </position>' + \
+           '\n      <rotation>' + \
+           '\n        <x>{}</x>' + \
+           '\n        <y>{}</y>' + \
+           '\n        <z>{}</z>' + \
+           '\n      </rotation>' + \
+           '\n      <purpose>Functional</purpose>' + \
+           '\n    </TrackBlueprint>'
+
+# XML code of a single item, as found inside the "blueprints" tag of a Liftoff track
+def format_item(item_id, instance_id, pos_x, pos_y, pos_z, rot_x, rot_y, rot_z):
+    return ITEM_XML.format(item_id,
+                           instance_id,
+                           round(pos_x, 3),
+                           round(pos_y, 3),
+                           round(pos_z, 3),
+                           round(rot_x, 3),
+                           round(rot_y, 3),
+                           round(rot_z, 3))
+
+# one line describing an instance, with its blueprint and placement in columns
+def format_placement(name, pos_x, pos_y, pos_z, rot_x, rot_y, rot_z):
+    name_str  = name.ljust(20, ' ')
+    pos_x_str = str(round(pos_x, 3)).ljust(10, ' ')
+    pos_y_str = str(round(pos_y, 3)).ljust(10, ' ')
+    pos_z_str = str(round(pos_z, 3)).ljust(10, ' ')
+    rot_x_str = str(round(rot_x, 3)).ljust(10, ' ')
+    rot_y_str = str(round(rot_y, 3)).ljust(10, ' ')
+    rot_z_str = str(round(rot_z, 3)).ljust(10, ' ')
+    
+    return name_str  + \
+           pos_x_str + \
+           pos_y_str + \
+           pos_z_str + \
+           rot_x_str + \
+           rot_y_str + \
+           rot_z_str
 
 
 
@@ -200,9 +380,14 @@ class Item:
 # This program applies rotations with regards to the global (fixed) XYZ axis,
 # while the Editor rotates the objects with regards to their local (moving) XYZ axis.
 class Blueprint:
-    def __init__(self, name):
+    def __init__(self, name, items=None):
         self.name = name
-        self.items = list()
+        # items are stored column by column, so that the whole blueprint is transformed at once
+        self.items = ItemTable() if items is None else items
+        # data shared by all the instances of this blueprint, see build_cache
+        self._cache = None
+        # XML code of the items, see xml
+        self._xml = None
         self.pos_x = 0
         self.pos_y = 0
         self.pos_z = 0
@@ -216,85 +401,136 @@ class Blueprint:
         self.pos_y += y
         self.pos_z += z
         # translation of items
-        for item in self.items:
-            item.translate(x, y, z)
+        self.items.positions += (x, y, z)
+        self._invalidate()
 
     def rotate(self, pitch, yaw, roll):
-        # this rotation is actually a translation of the center of each item
-        self._rotate_y(yaw)
-        self._rotate_x(pitch)
-        self._rotate_z(roll)
-        # here comes the real rotation, the toughest part of the program
-        for item in self.items:
-            item.rotate(pitch, yaw, roll)
-
-    def _rotate_x(self, angle):
-        rotation = Quaternion(axis=[1, 0, 0], angle=radians(angle))
-        
-        # rotation of center
-        self.rot_x = (self.rot_x + angle) % 360
-        # translation of items
-        for item in self.items:
-            item.pos_x, item.pos_y, item.pos_z = rotate(item.pos_x, item.pos_y, item.pos_z,
-                                                        self.pos_x, self.pos_y, self.pos_z,
-                                                        rotation)
-
-    def _rotate_y(self, angle):
-        rotation = Quaternion(axis=[0, 1, 0], angle=radians(angle))
-        
-        # rotation of center
-        self.rot_y = (self.rot_y + angle) % 360
-        # translation of items
-        for item in self.items:
-            item.pos_x, item.pos_y, item.pos_z = rotate(item.pos_x, item.pos_y, item.pos_z,
-                                                        self.pos_x, self.pos_y, self.pos_z,
-                                                        rotation)
-
-    def _rotate_z(self, angle):
-        rotation = Quaternion(axis=[0, 0, 1], angle=radians(angle))
-        
         # rotation of center
-        self.rot_z = (self.rot_z + angle) % 360
-        # translation of items
-        for item in self.items:
-            item.pos_x, item.pos_y, item.pos_z = rotate(item.pos_x, item.pos_y, item.pos_z,
-                                                        self.pos_x, self.pos_y, self.pos_z,
-                                                        rotation)
+        self.rot_y = (self.rot_y + yaw) % 360
+        self.rot_x = (self.rot_x + pitch) % 360
+        self.rot_z = (self.rot_z + roll) % 360
+        # the three global rotations YXZ are composed in a single quaternion
+        rotation = global_euler_to_quat(pitch, yaw, roll)
+        # this rotation is actually a translation of the center of each item
+        self.items.positions = rotate_array(self.items.positions, (self.pos_x, self.pos_y, self.pos_z), rotation)
+        # here comes the real rotation, the toughest part of the program:
+        # the final quaternion of each item is the product of two rotations
+        # - the initial one when the item is placed inside the blueprint
+        # - the last one when the blueprint itself is rotated in the world
+        self.items.quats = quat_multiply(rotation, self.items.quats)
+        self.items.rotations = quat_to_euler_array(self.items.quats)
+        self._invalidate()
 
     def add(self, item):
-        self.items.append(item)
+        table, index = item._table, item._index
+        self.items.append(item.item_id, item.instance_id,
+                          table._positions[index], table._rotations[index], table._quats[index])
+        self._invalidate()
 
     def remove(self):
         pass
 
     def sync_instance_id(self, instance_id_counter):
-        for item in self.items:
-            instance_id_counter += 1
-            item.instance_id = instance_id_counter
-        return instance_id_counter
+        instance_ids = np.arange(instance_id_counter + 1, instance_id_counter + len(self.items) + 1)
+        # renumbering drops the XML code only if some ID actually changes
+        if not np.array_equal(self.items.instance_ids, instance_ids):
+            self.items.instance_ids = instance_ids
+            self._xml = None
+        return instance_id_counter + len(self.items)
+
+    # drop everything computed from the items, called whenever they change
+    # items modified directly through their views are not tracked, so call it after doing that
+    def _invalidate(self):
+        self._cache = None
+        self._xml = None
     
     def copy(self):
         copied_blueprint = Blueprint(self.name)
-        for item in self.items:
-            copied_blueprint.add(item.copy())
+        copied_blueprint.items = self.items.copy()
+        copied_blueprint._xml = self._xml
         return copied_blueprint
-    
+
+    # precompute what every instance of this blueprint starts from:
+    # the item IDs, the offsets of the items from the center and their initial quaternions
+    # the cache is dropped whenever the blueprint itself is modified
+    def build_cache(self):
+        if self._cache is None:
+            offsets = self.items.positions - (self.pos_x, self.pos_y, self.pos_z)
+            quats = self.items.quats.copy()
+            offsets.flags.writeable = False
+            quats.flags.writeable = False
+            self._cache = (tuple(self.items.item_ids), offsets, quats)
+        return self._cache
+
+    # create a new instance of this blueprint translated and then rotated around its new center
+    # this gives the same result as copy, translate and rotate but it only transforms the cached data once
+    # @return the new instance, whose instance IDs still have to be assigned with sync_instance_id
+    def instantiate(self, x, y, z, pitch, yaw, roll):
+        return self.instantiate_many(((x, y, z, pitch, yaw, roll),))[0]
+
+    # create many instances of this blueprint at once, as instantiate does for each placement
+    # @param placements = array of shape (K, 6) with x, y, z, pitch, yaw, roll of each instance
+    # @param counters = array of shape (K,) with the instance ID counter before each instance,
+    #                   whose items are numbered from counter+1 onwards, or None to leave them to sync_instance_id
+    # @return list of K instances, whose items are views over arrays shared by the whole batch
+    def instantiate_many(self, placements, counters=None):
+        with ele_profile.phase("rotate"):
+            arrays = self.transform_many(placements, counters)
+        with ele_profile.phase("instantiate"):
+            return self.instances_from_arrays(*arrays)
+
+    # the numeric part of instantiate_many, which can run in another process
+    # @return (centers, angles, instance_ids, positions, rotations, quats) with one row per instance
+    #         and, for the last four, one column per item
+    def transform_many(self, placements, counters=None):
+        item_ids, offsets, quats = self.build_cache()
+        placements = np.asarray(placements, dtype=float).reshape(-1, 6)
+        n_items = len(item_ids)
+
+        centers = placements[:, :3] + (self.pos_x, self.pos_y, self.pos_z)
+        angles = (placements[:, 3:] + (self.rot_x, self.rot_y, self.rot_z)) % 360
+        rotations = global_euler_to_quat_array(placements[:, 3:])
+
+        positions = offsets @ quat_to_matrix(rotations).transpose(0, 2, 1) + centers[:, None, :]
+        all_quats = quat_multiply(rotations[:, None, :], quats[None, :, :])
+        all_rotations = quat_to_euler_array(all_quats)
+        if counters is None:
+            instance_ids = np.zeros((len(placements), n_items), dtype=np.int64)
+        else:
+            instance_ids = np.asarray(counters, dtype=np.int64)[:, None] + np.arange(1, n_items + 1)
+        return (centers, angles, instance_ids, positions, all_rotations, all_quats)
+
+    # move an instance of this blueprint, given its row of the arrays returned by transform_many
+    # the items take the given arrays without copying them, and keep their item and instance IDs
+    # @raise ValueError if the number of items does not match
+    def place(self, center, angle, positions, rotations, quats):
+        if len(positions) != len(self.items):
+            raise ValueError("{} has {} items, not {}".format(self.name, len(self.items), len(positions)))
+        self.pos_x, self.pos_y, self.pos_z = center
+        self.rot_x, self.rot_y, self.rot_z = angle
+        self.items = ItemTable.from_arrays(self.items.item_ids, self.items.instance_ids, positions, rotations, quats)
+        self._invalidate()
+
+    # placement and items of an instance, which place puts back
+    # the arrays are shared with the instance, so they stay valid only as long as it is moved by place alone
+    def state(self):
+        return ((self.pos_x, self.pos_y, self.pos_z), (self.rot_x, self.rot_y, self.rot_z),
+                self.items.positions, self.items.rotations, self.items.quats)
+
+    # the instances described by the arrays returned by transform_many
+    def instances_from_arrays(self, centers, angles, instance_ids, positions, rotations, quats):
+        item_ids = self.build_cache()[0]
+        instances = list()
+        for center, angle, ids, position, rotation, quat in zip(centers.tolist(), angles.tolist(),
+                                                               instance_ids, positions, rotations, quats):
+            instance = Blueprint(self.name, ItemTable.from_arrays(list(item_ids), ids, position, rotation, quat))
+            instance.pos_x, instance.pos_y, instance.pos_z = center
+            instance.rot_x, instance.rot_y, instance.rot_z = angle
+            instances.append(instance)
+        return instances
+
     def pretty_print(self):
-        name_str  = self.name.ljust(20, ' ')
-        pos_x_str = str(round(self.pos_x, 3)).ljust(10, ' ')
-        pos_y_str = str(round(self.pos_y, 3)).ljust(10, ' ')
-        pos_z_str = str(round(self.pos_z, 3)).ljust(10, ' ')
-        rot_x_str = str(round(self.rot_x, 3)).ljust(10, ' ')
-        rot_y_str = str(round(self.rot_y, 3)).ljust(10, ' ')
-        rot_z_str = str(round(self.rot_z, 3)).ljust(10, ' ')
-        
-        return name_str  + \
-               pos_x_str + \
-               pos_y_str + \
-               pos_z_str + \
-               rot_x_str + \
-               rot_y_str + \
-               rot_z_str
+        return format_placement(self.name, self.pos_x, self.pos_y, self.pos_z, self.rot_x, self.rot_y, self.rot_z)
 
     def serialize(self):
         return "{}:{}:{}:{}:{}:{}:{}".format(self.name,
@@ -305,8 +541,29 @@ class Blueprint:
                                        round(self.rot_y, 3),
                                        round(self.rot_z, 3))
 
+    # XML code of the items, one string per item
+    # coordinates are converted to Python floats all together, then rounded one by one by format_item
+    # as np.round would round some of them differently
+    # @param keep = boolean array telling which items are written, all of them by default
+    # @param first_id = instance ID written for the first item, the others following it, by default the IDs of the items
+    def iter_xml(self, keep=None, first_id=None):
+        items = self.items
+        instance_ids = items.instance_ids.tolist() if first_id is None else range(first_id, first_id + len(items))
+        rows = zip(items.item_ids, instance_ids, items.positions.tolist(), items.rotations.tolist())
+        if keep is not None:
+            rows = (row for row, kept in zip(rows, keep.tolist()) if kept)
+        for item_id, instance_id, position, rotation in rows:
+            yield format_item(item_id, instance_id, *position, *rotation)
+
+    # XML code of all the items, built once and kept until the items are moved, rotated, added or renumbered
+    def xml(self):
+        if self._xml is None:
+            self._xml = ''.join(self.iter_xml())
+        return self._xml
+
+    # forget the XML code kept by xml, to give its memory back
+    def drop_xml(self):
+        self._xml = None
+
     def __str__(self):
-        xml_output = ""
-        for item in self.items:
-            xml_output += str(item)
-        return xml_output
+        return self.xml()